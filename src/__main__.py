@@ -1,5 +1,6 @@
 import pathlib
 
+from . import discovery
 from . import http
 
 if __name__ == "__main__":
@@ -21,5 +22,9 @@ if __name__ == "__main__":
         "SeLa,Selz,StRh,ViNe,Vree,Vure,Weil&KG={parameter}"
     )
     folder = pathlib.Path(r"./data")
-    extractor = http.HTTPExtractor(url, 1978, 2018, folder)
+    # Rebuilds `all_parameters.txt` from the tables pages before the extraction.
+    discover = False
+    if discover:
+        discovery.ParameterDiscovery(folder / "results", 1978, 2018).run()
+    extractor = http.HTTPExtractor(url, 1978, 2018, folder, mode=http.ASYNC_MODE)
     extractor.run()
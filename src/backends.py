@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import abc
+import datetime
+import pathlib
+import sqlite3
+import typing
+
+import pandas as pd
+
+try:
+    import pyodbc
+except ImportError:
+    # The Access backend is only available on Windows, with an ODBC driver.
+    pyodbc = None
+
+ACCESS_PATH = pathlib.Path(r"C:\Users\cassandra\Documents\Qualité Sédiments\IKSR\IKSR.accdb")
+
+QUERY_IKSR_DATA = (
+    "insert into iksr_data(station, fleuve, matrice, groupe, parameter, type_prelevement, annee, periode, _date, "
+    "caracteres_specifiques, valeur) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+class Backend(abc.ABC):
+    """
+    Storage of the `iksr_data` and `parameters` tables.
+
+    :attr:`cnxn` and :attr:`cursor` follow the DB-API and :attr:`Error` and
+    :attr:`IntegrityError` are the exceptions raised by the driver.
+    """
+
+    Error: typing.Type[Exception] = Exception
+    IntegrityError: typing.Type[Exception] = Exception
+
+    def __init__(self):
+        self.cnxn = self.connect()
+        self.cursor = self.cnxn.cursor()
+        self.query_iksr_data = QUERY_IKSR_DATA
+        self.query_parameters = "insert into parameters(parameter, unit) values (?, ?)"
+
+    @abc.abstractmethod
+    def connect(self):
+        pass
+
+    @abc.abstractmethod
+    def free(self) -> None:
+        """
+        Deletes all the rows of both tables.
+        """
+
+    def close(self) -> None:
+        self.cursor.close()
+        self.cnxn.close()
+
+
+class AccessBackend(Backend):
+    """
+    Microsoft Access database, through ODBC.
+    """
+
+    def __init__(self, path: pathlib.Path = ACCESS_PATH, fast_executemany: bool = True):
+        assert pyodbc is not None, "pyodbc is required by the Access backend."
+        self.Error = pyodbc.Error
+        self.IntegrityError = pyodbc.IntegrityError
+        self.path = path
+        self.info = r"DRIVER={Microsoft Access Driver (*.mdb, *.accdb)};" f"DBQ={path}"
+        super().__init__()
+        self.cursor.fast_executemany = fast_executemany
+        self.query_parameters = f"insert into [{path}].parameters(parameter, unit) values (?, ?)"
+
+    def connect(self):
+        return pyodbc.connect(self.info)
+
+    def free(self) -> None:
+        self.cursor.execute("delete * from iksr_data")
+        self.cnxn.commit()
+        self.cursor.execute(f"delete * from [{self.path}].parameters")
+        self.cnxn.commit()
+        self.cursor.execute("alter table iksr_data ALTER COLUMN id COUNTER(1,1)")
+        self.cnxn.commit()
+
+
+class SQLiteBackend(Backend):
+    """
+    Local SQLite database in WAL mode, created if it doesn't exist.
+    """
+
+    Error = sqlite3.Error
+    IntegrityError = sqlite3.IntegrityError
+
+    def __init__(self, path: pathlib.Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        super().__init__()
+        self.cursor.execute("pragma journal_mode=wal")
+        self.cursor.execute("pragma synchronous=normal")
+        self.cursor.execute(
+            "create table if not exists iksr_data ("
+            "id integer primary key autoincrement, "
+            "station text, "
+            "fleuve text, "
+            "matrice text, "
+            "groupe text, "
+            "parameter text, "
+            "type_prelevement text, "
+            "annee integer, "
+            "periode text, "
+            "_date timestamp, "
+            "caracteres_specifiques text, "
+            "valeur real)"
+        )
+        self.cursor.execute(
+            "create table if not exists parameters ("
+            "id integer primary key autoincrement, "
+            "parameter text, "
+            "unit text, "
+            "unique (parameter, unit))"
+        )
+        self.cnxn.commit()
+
+    def connect(self):
+        return sqlite3.connect(str(self.path))
+
+    def free(self) -> None:
+        self.cursor.execute("delete from iksr_data")
+        self.cursor.execute("delete from parameters")
+        self.cursor.execute("delete from sqlite_sequence where name in ('iksr_data', 'parameters')")
+        self.cnxn.commit()
+
+
+def _adapt_datetime(value: datetime.datetime) -> str:
+    return value.isoformat(" ")
+
+
+# Dates of the rows are `pd.Timestamp`, which SQLite can't bind by default.
+sqlite3.register_adapter(datetime.datetime, _adapt_datetime)
+sqlite3.register_adapter(pd.Timestamp, _adapt_datetime)
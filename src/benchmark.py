@@ -0,0 +1,132 @@
+"""
+Benchmark of :class:`src.http.HTTPExtractor` against :class:`FakeIKSRServer`.
+
+Example::
+
+    python -m src.benchmark --years 1 10 --parameters 10 50 --modes threads async
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+import typing
+
+import loguru
+
+from . import http
+from .extractor import remove_log_sink
+from .fake_server import FakeIKSRServer
+from .scheduler import AdaptiveLimit
+from .scheduler import Scheduler
+from .scheduler import TokenBucket
+
+FIRST_YEAR = 1978
+
+
+def run_once(
+    server: FakeIKSRServer, years: int, parameters: int, mode: str, rate: float, max_in_flight: int
+) -> typing.Dict[str, typing.Any]:
+    """
+    Runs a fresh extraction of :param:`years` years by :param:`parameters`
+    parameters and returns its summary.
+    """
+    folder = pathlib.Path(tempfile.mkdtemp(prefix="iksr_benchmark_"))
+    try:
+        results = folder / "results"
+        results.mkdir()
+        with open(str(results / "all_parameters.txt"), "w") as all_params_file:
+            for i in range(parameters):
+                all_params_file.write(f"P{i}\n")
+        scheduler = Scheduler(
+            rate_limit=TokenBucket(rate=rate, capacity=max_in_flight),
+            limit=AdaptiveLimit(initial=max_in_flight, maximum=max_in_flight),
+        )
+        extractor = http.HTTPExtractor(
+            server.url,
+            FIRST_YEAR,
+            FIRST_YEAR + years - 1,
+            folder,
+            mode=mode,
+            max_in_flight=max_in_flight,
+            max_generate=max_in_flight,
+            max_download=max_in_flight,
+            scheduler=scheduler,
+        )
+        start = time.monotonic()
+        extractor.run()
+        wall = time.monotonic() - start
+        summary = extractor.metrics.summary()
+        extractor.cache.close()
+        remove_log_sink(results)
+    finally:
+        shutil.rmtree(str(folder), ignore_errors=True)
+    return {
+        "years": years,
+        "parameters": parameters,
+        "mode": mode,
+        "wall": wall,
+        "jobs_per_second": years * parameters / wall if wall else 0.0,
+        "p50": summary["latency"]["p50"],
+        "p95": summary["latency"]["p95"],
+        "p99": summary["latency"]["p99"],
+        "retries": summary["retries"],
+        "status": summary["status"],
+    }
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> typing.List[typing.Dict[str, typing.Any]]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 5])
+    parser.add_argument("--parameters", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--modes", nargs="+", default=list(http.MODES), choices=http.MODES)
+    parser.add_argument("--generate-latency", type=float, default=0.05)
+    parser.add_argument("--download-latency", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--rows", type=int, default=100, help="Number of rows of each CSV file.")
+    parser.add_argument("--rate", type=float, default=1000.0, help="Maximum number of requests per second.")
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=pathlib.Path, help="JSON file where the results are written.")
+    args = parser.parse_args(argv)
+
+    loguru.logger.remove()
+    loguru.logger.add(sys.stderr, level="WARNING")
+
+    server = FakeIKSRServer(
+        generate_latency=args.generate_latency,
+        download_latency=args.download_latency,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        # Hang longer than the timeouts of the scheduler.
+        hang=15.0,
+        rows=args.rows,
+        seed=args.seed,
+    )
+    results = []
+    with server:
+        for years in args.years:
+            for parameters in args.parameters:
+                for mode in args.modes:
+                    result = run_once(server, years, parameters, mode, args.rate, args.max_in_flight)
+                    results.append(result)
+                    print(
+                        f"{years:>3} years x {parameters:>4} parameters, {mode:>7}: {result['wall']:7.2f}s, "
+                        f"{result['jobs_per_second']:7.1f} jobs/s, p50 {result['p50']:.3f}s, "
+                        f"p95 {result['p95']:.3f}s, p99 {result['p99']:.3f}s, {result['retries']} retries, "
+                        f"{result['status']}"
+                    )
+    if args.output:
+        with open(str(args.output), "w") as output_file:
+            json.dump(results, output_file, indent=4)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import concurrent.futures
+import html
+import pathlib
+import re
+import typing
+import urllib.parse
+import zipfile
+
+import loguru
+import requests
+from selenium import webdriver
+
+from .cache import ArchiveCache
+from .extractor import BOOKS
+from .extractor import Extractor
+from .extractor import save_sheet_archive
+from .http import get_archive_url
+from .session import SessionPool
+
+# Returns the [url, book] of each sheet of the page, in the order of the page.
+# The book of a sheet is the last book image before it.
+JS_SHEETS = """
+const books = arguments[0];
+const sheets = [];
+let book = null;
+for (const element of document.querySelectorAll("img, a")) {
+    if (element.tagName === "IMG") {
+        const src = element.src.toLowerCase();
+        book = books.find(b => src.includes(b)) || book;
+    } else if (book && element.href && element.href.includes("KG=")) {
+        sheets.push([element.href, book]);
+    }
+}
+return sheets;
+"""
+
+# Expands the collapsed lists and returns how many were expanded.
+JS_EXPAND = """
+const icons = Array.from(document.querySelectorAll("img")).filter(i => /plus/i.test(i.src));
+icons.forEach(i => i.click());
+return icons.length;
+"""
+
+# Link of the "generate" step of a download, in a sheet page
+DOWNLOAD_LINK = re.compile(r"""["']([^"']*dl_zippen\.asp[^"']*)["']""")
+# Link of a sheet, in a `javascript:` URL
+SHEET_LINK = re.compile(r"""["']([^"']*KG=[^"']*)["']""")
+
+FIREFOX = "firefox"
+CHROME = "chrome"
+
+
+def make_driver(browser: str = FIREFOX, headless: bool = True) -> webdriver.Remote:
+    if browser == FIREFOX:
+        options = webdriver.FirefoxOptions()
+        if headless:
+            options.add_argument("-headless")
+        return webdriver.Firefox(options=options)
+    assert browser == CHROME, f"Unknown browser {browser}."
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument("--headless")
+    return webdriver.Chrome(options=options)
+
+
+def sheet_url(href: str, base: str) -> str:
+    if href.startswith("javascript:"):
+        match = SHEET_LINK.search(href)
+        href = match.group(1) if match else href
+    return urllib.parse.urljoin(base, href)
+
+
+def sheet_parameter(url: str) -> str:
+    return urllib.parse.parse_qs(urllib.parse.urlparse(url).query).get("KG", [""])[0]
+
+
+class BrowserExtractor(Extractor):
+    """
+    Extracts the same sheets as :class:`src.gui.GUIExtractor`, into the same
+    `results/<year>/<colour>/` layout, from the DOM of the tables page in a
+    headless browser instead of screenshots.
+
+    The browser only loads the tables page of each year, expands its lists and
+    reads the links of the sheets and their book. The sheet pages and the
+    archives their download link points to are then fetched with the cookies
+    of the browser, by :param:`max_workers` threads.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        _min: int,
+        _max: int,
+        folder: pathlib.Path,
+        delete_existing: bool = False,
+        cache: typing.Optional[ArchiveCache] = None,
+        browser: str = FIREFOX,
+        headless: bool = True,
+        max_workers: int = 4,
+        timeout: float = 30,
+    ):
+        super().__init__(url, _min, _max, folder, delete_existing, cache)
+        self.browser = browser
+        self.headless = headless
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.years = [str(year) for year in self.all_years]
+
+    def run(self):
+        driver = make_driver(self.browser, self.headless)
+        driver.set_page_load_timeout(self.timeout)
+        try:
+            with SessionPool(pool_size=self.max_workers) as session_pool:
+                for year in self.years:
+                    loguru.logger.info(f"Current year is {year}.")
+                    sheets = self.read_sheets(driver, year)
+                    cookies = {c["name"]: c["value"] for c in driver.get_cookies()}
+                    self.save_sheets(session_pool, cookies, year, sheets)
+        finally:
+            driver.quit()
+
+    def read_sheets(
+        self, driver: webdriver.Remote, year: str, max_rounds: int = 10
+    ) -> typing.List[typing.Tuple[str, str]]:
+        """
+        Returns the (url, book) of the sheets of the tables page of this
+        :param:`year`, without duplicates.
+        """
+        driver.get(self.default_url + year)
+        sheets = driver.execute_script(JS_SHEETS, list(BOOKS))
+        # Expand the lists until there are no new sheets.
+        for _ in range(max_rounds):
+            if not driver.execute_script(JS_EXPAND):
+                break
+            expanded = driver.execute_script(JS_SHEETS, list(BOOKS))
+            if len(expanded) == len(sheets):
+                break
+            sheets = expanded
+        base = driver.current_url
+        return list(dict.fromkeys((sheet_url(href, base), book) for href, book in sheets))
+
+    def save_sheets(
+        self,
+        session_pool: SessionPool,
+        cookies: typing.Dict[str, str],
+        year: str,
+        sheets: typing.List[typing.Tuple[str, str]],
+    ) -> None:
+        for book in BOOKS:
+            (self.results / year / book).mkdir(parents=True, exist_ok=True)
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            futures = {
+                executor.submit(self.save_sheet, session_pool, cookies, year, url, book): url for url, book in sheets
+            }
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except (requests.RequestException, zipfile.BadZipFile) as err:
+                    loguru.logger.error(f"[{year}, {futures[future]}]: ERROR, {err}.")
+
+    def save_sheet(
+        self, session_pool: SessionPool, cookies: typing.Dict[str, str], year: str, url: str, book: str
+    ) -> typing.Optional[pathlib.Path]:
+        parameter = sheet_parameter(url)
+        response = session_pool.get(url, cookies=cookies, timeout=self.timeout)
+        response.raise_for_status()
+        match = DOWNLOAD_LINK.search(response.content.decode(encoding="latin1"))
+        if match is None:
+            loguru.logger.info(f"[{year}, {book}, {parameter}]: no data to save.")
+            return
+        generate_url = urllib.parse.urljoin(response.url, html.unescape(match.group(1)))
+
+        response = session_pool.get(generate_url, cookies=cookies, timeout=self.timeout)
+        response.raise_for_status()
+        archive_url = urllib.parse.urljoin(response.url, get_archive_url(response.content))
+        response = session_pool.get(archive_url, cookies=cookies, timeout=self.timeout)
+        response.raise_for_status()
+
+        csv_file = save_sheet_archive(self.cache, response.content, self.results / year / book, year, book)
+        if csv_file is None:
+            loguru.logger.error(f"[{year}, {book}, {parameter}]: no CSV file in the archive.")
+        else:
+            loguru.logger.info(f"[{year}, {book}, {parameter}]: OK.")
+        return csv_file
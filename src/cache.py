@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+import pathlib
+import shutil
+import sqlite3
+import threading
+import time
+import typing
+import zipfile
+
+import loguru
+
+# Sources of the archives
+GUI = "gui"
+HTTP = "http"
+
+
+def extract_csv(
+    zip_file: zipfile.ZipFile, get_target: typing.Callable[[str], pathlib.Path]
+) -> typing.Optional[pathlib.Path]:
+    """
+    Streams the CSV file of :param:`zip_file` to the path returned by
+    :param:`get_target` for its name, and returns this path. Returns `None` if
+    there is no CSV file in the archive.
+    """
+    csv_name = next(iter([n for n in zip_file.namelist() if n.lower().endswith(".csv")]), None)
+    if csv_name is None:
+        return
+    target = get_target(pathlib.PurePath(csv_name).name)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_target = target.with_name(f"{target.name}.part")
+    with zip_file.open(csv_name) as csv_file, open(str(tmp_target), "wb") as tmp_file:
+        shutil.copyfileobj(csv_file, tmp_file)
+    os.replace(str(tmp_target), str(target))
+    return target
+
+
+class ArchiveCache:
+    """
+    Thread safe, content-addressed cache of the downloaded archives.
+
+    Archives are stored once per content under `blobs/` and indexed by
+    (source, year, key), where the key is the parameter (HTTP) or the sheet
+    (GUI). Each entry also knows where its CSV file goes in the results
+    folder, so that :meth:`rebuild` can regenerate it without any download.
+    When the archives take more than :param:`max_bytes` bytes, the least
+    recently used entries are evicted.
+    """
+
+    def __init__(self, folder: pathlib.Path, max_bytes: int = 10 * 2**30):
+        self.folder = folder
+        self.blobs = folder / "blobs"
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._mutex = threading.Lock()
+        self._cnxn = sqlite3.connect(str(folder / "index.sqlite"), check_same_thread=False)
+        self._cnxn.execute("pragma journal_mode=wal")
+        self._cnxn.execute(
+            "create table if not exists entries ("
+            "source text not null, "
+            "year text not null, "
+            "key text not null, "
+            "digest text not null, "
+            "size integer not null, "
+            "target text not null, "
+            "last_used real not null, "
+            "primary key (source, year, key))"
+        )
+        self._cnxn.commit()
+
+    def __enter__(self) -> ArchiveCache:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        with self._mutex:
+            self._cnxn.close()
+
+    def _blob(self, digest: str) -> pathlib.Path:
+        return self.blobs / digest[:2] / f"{digest}.zip"
+
+    def put(self, source: str, year: str, key: str, content: bytes, target: str) -> str:
+        """
+        Stores an archive and returns its digest. :param:`target` is the path
+        of its CSV file, relative to the results folder.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        blob = self._blob(digest)
+        if not blob.exists():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            tmp_blob = blob.with_name(f"{blob.name}.{threading.get_ident()}.part")
+            with open(str(tmp_blob), "wb") as tmp_file:
+                tmp_file.write(content)
+            os.replace(str(tmp_blob), str(blob))
+        with self._mutex:
+            self._cnxn.execute(
+                "insert or replace into entries(source, year, key, digest, size, target, last_used) "
+                "values (?, ?, ?, ?, ?, ?, ?)",
+                (source, year, key, digest, len(content), target, time.time()),
+            )
+            self._cnxn.commit()
+            self._evict()
+        return digest
+
+    def get(self, source: str, year: str, key: str) -> typing.Optional[bytes]:
+        # The blob is read under the mutex, so that it isn't evicted meanwhile.
+        with self._mutex:
+            row = self._cnxn.execute(
+                "select digest from entries where source = ? and year = ? and key = ?", (source, year, key)
+            ).fetchone()
+            if row is None:
+                return
+            try:
+                content = self._blob(row[0]).read_bytes()
+            except FileNotFoundError:
+                # Deleted from outside the cache.
+                self._cnxn.execute("delete from entries where source = ? and year = ? and key = ?", (source, year, key))
+                self._cnxn.commit()
+                return
+            self._cnxn.execute(
+                "update entries set last_used = ? where source = ? and year = ? and key = ?",
+                (time.time(), source, year, key),
+            )
+            self._cnxn.commit()
+        return content
+
+    def entries(self, source: typing.Optional[str] = None) -> typing.List[typing.Tuple[str, str, str, str]]:
+        """
+        Returns the (source, year, key, target) of each entry.
+        """
+        query = "select source, year, key, target from entries"
+        with self._mutex:
+            if source is None:
+                return self._cnxn.execute(query).fetchall()
+            return self._cnxn.execute(f"{query} where source = ?", (source,)).fetchall()
+
+    @property
+    def size(self) -> int:
+        with self._mutex:
+            return self._size()
+
+    def _size(self) -> int:
+        # A same archive may be shared by several entries.
+        row = self._cnxn.execute("select sum(size) from (select distinct digest, size from entries)").fetchone()
+        return row[0] or 0
+
+    def _evict(self) -> None:
+        size = self._size()
+        while size > self.max_bytes:
+            source, year, key, digest = self._cnxn.execute(
+                "select source, year, key, digest from entries order by last_used limit 1"
+            ).fetchone()
+            self._cnxn.execute("delete from entries where source = ? and year = ? and key = ?", (source, year, key))
+            if not self._cnxn.execute("select 1 from entries where digest = ?", (digest,)).fetchone():
+                blob = self._blob(digest)
+                if blob.exists():
+                    blob.unlink()
+            self._cnxn.commit()
+            size = self._size()
+
+    def rebuild(self, results: pathlib.Path, source: typing.Optional[str] = None) -> int:
+        """
+        Regenerates the CSV files of the results folder from the cached
+        archives, without any download. Returns the number of files written.
+        """
+        written = 0
+        for _source, year, key, target in self.entries(source):
+            content = self.get(_source, year, key)
+            if content is None:
+                loguru.logger.error(f"[{_source}, {year}, {key}]: archive missing from the cache.")
+                continue
+            try:
+                with zipfile.ZipFile(io.BytesIO(content)) as zip_file:
+                    csv_file = extract_csv(zip_file, lambda _: results / target)
+            except zipfile.BadZipFile as err:
+                loguru.logger.error(f"[{_source}, {year}, {key}]: {err}.")
+                continue
+            if csv_file is not None:
+                written += 1
+        loguru.logger.info(f"{written} files rebuilt from the cache.")
+        return written
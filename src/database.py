@@ -1,14 +1,22 @@
 from __future__ import annotations
 
-import datetime
+import collections
+import concurrent.futures
+import dataclasses
+import functools
+import io
+import os
 import pathlib
 import typing
 
 import pandas as pd
-import pyodbc
 from loguru import logger
 
+from .backends import AccessBackend
+from .backends import Backend
 
+
+@functools.lru_cache(maxsize=None)
 def split_parameter(value: str) -> typing.Tuple[str, str]:
     # Replace ` in ` into ` en `.
     value = value.replace(" in ", " en ")
@@ -20,20 +28,170 @@ def split_parameter(value: str) -> typing.Tuple[str, str]:
     return parameter, unit
 
 
+class ParameterRegistry:
+    """
+    Distinct (parameter, unit) pairs found during a run, each one with a
+    compact integer key.
+    """
+
+    def __init__(self):
+        self._keys: typing.Dict[typing.Tuple[str, str], int] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, parameter: str, unit: str) -> int:
+        """
+        Registers a (:param:`parameter`, :param:`unit`) pair if needed and
+        returns its key.
+        """
+        return self._keys.setdefault((parameter, unit), len(self._keys) + 1)
+
+    @property
+    def rows(self) -> typing.List[typing.List]:
+        return [[parameter, unit] for parameter, unit in self._keys]
+
+
+COLUMNS = [
+    "Station de mesure",
+    "fleuve",
+    "matrice",
+    "groupe",
+    "paramètres",
+    "type de prélèvement",
+    "année",
+    "période",
+    "date",
+    "caractères spécifiques",
+    "valeur",
+]
+
+
+@dataclasses.dataclass
+class Batch:
+    """
+    Rows of a CSV file, ready to be inserted, and the distinct parameters
+    they refer to.
+    """
+
+    csv_file: pathlib.Path
+    rows: typing.List[typing.List]
+    parameters: typing.List[typing.Tuple[str, str]]
+
+
+def normalize(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Normalizes the columns of a CSV file: decimal commas, missing values, dates
+    and parameters. The unit of each parameter is moved to a new `unité`
+    column.
+    """
+    df = df.copy()
+    valeur = df["valeur"]
+    if not pd.api.types.is_numeric_dtype(valeur):
+        valeur = pd.to_numeric(valeur.astype("string").str.replace(",", ".", regex=False)).astype(float)
+    df["valeur"] = valeur.fillna(0)
+    df["caractères spécifiques"] = df["caractères spécifiques"].fillna("")
+    df["date"] = pd.to_datetime(df["date"], format="%d.%m.%Y")
+    # Split each distinct parameter only once.
+    splitted = {value: split_parameter(str(value)) for value in df["paramètres"].unique()}
+    df["unité"] = df["paramètres"].map(lambda value: splitted[value][1])
+    df["paramètres"] = df["paramètres"].map(lambda value: splitted[value][0])
+    return df
+
+
+@dataclasses.dataclass
+class Chunk:
+    """
+    Lines of a CSV file between the offsets :attr:`start` and :attr:`end`.
+    """
+
+    csv_file: pathlib.Path
+    start: int
+    end: int
+
+
+def get_chunks(csv_file: pathlib.Path, chunk_bytes: int) -> typing.List[Chunk]:
+    """
+    Splits a CSV file, after its header, into chunks of about
+    :param:`chunk_bytes` bytes ending on a line break.
+    """
+    size = os.path.getsize(str(csv_file))
+    chunks: typing.List[Chunk] = []
+    with open(str(csv_file), "rb") as _file:
+        _file.readline()
+        start = _file.tell()
+        while start < size:
+            _file.seek(min(start + chunk_bytes, size))
+            _file.readline()
+            end = _file.tell()
+            chunks.append(Chunk(csv_file, start, end))
+            start = end
+    return chunks
+
+
+def _to_batch(csv_file: pathlib.Path, df: pd.DataFrame) -> Batch:
+    assert list(df.columns) == COLUMNS
+    df = normalize(df)
+    rows = df[COLUMNS].astype(object).values.tolist()
+    parameters = list(dict.fromkeys(zip(df["paramètres"], df["unité"])))
+    return Batch(csv_file, rows, parameters)
+
+
+def read_file(csv_file: pathlib.Path) -> Batch:
+    """
+    Parses and normalizes a CSV file. This function doesn't touch the database
+    so that it can run in another process.
+    """
+    return _to_batch(csv_file, pd.read_csv(str(csv_file), sep=";", encoding="latin1"))
+
+
+def read_chunk(chunk: Chunk) -> Batch:
+    """
+    Same as :func:`read_file` for a :param:`chunk` of a CSV file only.
+    """
+    with open(str(chunk.csv_file), "rb") as _file:
+        header = _file.readline()
+        _file.seek(chunk.start)
+        content = _file.read(chunk.end - chunk.start)
+    df = pd.read_csv(io.BytesIO(header + content), sep=";", encoding="latin1")
+    return _to_batch(chunk.csv_file, df)
+
+
+def _bounded_map(
+    executor: concurrent.futures.Executor, func: typing.Callable, items: typing.Iterable, window: int
+) -> typing.Iterator:
+    """
+    Same as :meth:`executor.map` but with at most :param:`window` results
+    waiting to be consumed.
+    """
+    futures: typing.Deque[concurrent.futures.Future] = collections.deque()
+    for item in items:
+        futures.append(executor.submit(func, item))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
 class Database:
-    def __init__(self, folder: pathlib.Path, _min: int, _max: int, free: bool = True):
-        self.info = r"DRIVER={Microsoft Access Driver (*.mdb, *.accdb)};" \
-                    r"DBQ=C:\Users\cassandra\Documents\Qualité Sédiments\IKSR\IKSR.accdb"
-        self.cnxn: pyodbc.Connection = pyodbc.connect(self.info)
-        self.cursor: pyodbc.Cursor = self.cnxn.cursor()
-        self.query_iksr_data = "insert into iksr_data(station, fleuve, " \
-                               "matrice, groupe, parameter, type_prelevement," \
-                               " annee, periode, _date, caracteres_specifiques," \
-                               " valeur) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?," \
-                               " ?)"
-        self.query_parameters = r"insert into [C:\Users\cassandra\Documents" \
-                                r"\Qualité Sédiments\IKSR\IKSR.accdb]." \
-                                r"parameters(parameter, unit) values (?, ?)"
+    def __init__(
+        self,
+        folder: pathlib.Path,
+        _min: int,
+        _max: int,
+        free: bool = True,
+        processes: int = 1,
+        batch_size: int = 1000,
+        commit_interval: int = 10000,
+        chunk_bytes: int = 8 * 2 ** 20,
+        backend: typing.Optional[Backend] = None,
+    ):
+        # Microsoft Access is the historical backend.
+        self.backend = backend or AccessBackend()
+        self.cnxn = self.backend.cnxn
+        self.cursor = self.backend.cursor
+        self.query_iksr_data = self.backend.query_iksr_data
+        self.query_parameters = self.backend.query_parameters
 
         if free:
             self.free()
@@ -42,25 +200,51 @@ class Database:
         self.folder = folder
         self.years = [folder / str(year) for year in range(_min, _max + 1)]
         self._curr_year: str = str(_min)
+        # Number of processes parsing the CSV files. Rows are always inserted
+        # by this process, in the order of the files.
+        self.processes = processes
+        self._executor: typing.Optional[concurrent.futures.ProcessPoolExecutor] = None
+        # Files are read by chunks of about `chunk_bytes` bytes, so that the
+        # memory used doesn't depend on the size of the files.
+        self.chunk_bytes = chunk_bytes
+        # Rows of `iksr_data` are inserted by batches of `batch_size` rows and
+        # committed every `commit_interval` rows.
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self._pending: typing.List[typing.List] = []
+        # Queries executed since the last commit, replayed row by row if a
+        # batch fails.
+        self._uncommitted: typing.List[typing.Tuple[str, typing.List[typing.List]]] = []
+        self._uncommitted_rows = 0
+        # The parameters table is written once, at the end of the run.
+        self.registry = ParameterRegistry()
 
     def __enter__(self) -> Database:
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.cursor.close()
-        self.cnxn.close()
+        if exc_type is None:
+            self._flush()
+            self._commit()
+        self.backend.close()
 
     def free(self) -> None:
-        self.cursor.execute("delete * from iksr_data")
-        self.cnxn.commit()
-        self.cursor.execute(r"delete * from [C:\Users\cassandra\Documents"
-                            r"\Qualité Sédiments\IKSR\IKSR.accdb]."
-                            r"parameters")
-        self.cnxn.commit()
-        self.cursor.execute("alter table iksr_data ALTER COLUMN id COUNTER(1,1)")
-        self.cnxn.commit()
+        self.backend.free()
 
     def run(self):
+        if self.processes > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.processes) as executor:
+                self._executor = executor
+                self._run()
+            self._executor = None
+        else:
+            self._run()
+        self._flush()
+        self._insert_many(self.query_parameters, self.registry.rows)
+        self._commit()
+        logger.info(f"{len(self.registry)} distinct parameters.")
+
+    def _run(self):
         for year in self.years:
             self._curr_year = year.name
             assert year.exists(), f"{year} doesn't exist."
@@ -81,45 +265,56 @@ class Database:
 
     def work(self, files: typing.List[pathlib.Path]):
         print(f"{self._curr_year}: {len(files)}")
-        for csv_file in files:
-            self._work_on_file(csv_file)
-
-    def _work_on_file(self, csv_file: pathlib.Path):
-        df = pd.read_csv(str(csv_file), sep=";", encoding="latin1")
-        assert list(df.columns) == [
-            "Station de mesure",
-            "fleuve",
-            "matrice",
-            "groupe",
-            "paramètres",
-            "type de prélèvement",
-            "année",
-            "période",
-            "date",
-            "caractères spécifiques",
-            "valeur"
-        ]
-        for data in df.itertuples():
-            values = list(data)[1:]
-            valeur = values[-1]
-            carac_spe = values[-2]
-            parameter = values[4]
-            if isinstance(valeur, str):
-                values[-1] = float(valeur.replace(",", "."))
-            if pd.isna(valeur):
-                values[-1] = 0
-            if pd.isna(carac_spe):
-                values[-2] = ""
-            values[-3] = datetime.datetime.strptime(values[-3], "%d.%m.%Y")
-            parameter, unit = split_parameter(parameter)
-            values[4] = parameter
-
-            self._insert(self.query_iksr_data, values)
-            self._insert(self.query_parameters, [parameter, unit])
-
-    def _insert(self, query: str, values: typing.List):
+        chunks = (chunk for csv_file in files for chunk in get_chunks(csv_file, self.chunk_bytes))
+        if self._executor is None:
+            batches = map(read_chunk, chunks)
+        else:
+            batches = _bounded_map(self._executor, read_chunk, chunks, 2 * self.processes)
+        for batch in batches:
+            self._write(batch)
+
+    def _write(self, batch: Batch):
+        for parameter, unit in batch.parameters:
+            self.registry.add(parameter, unit)
+        self._pending.extend(batch.rows)
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        rows, self._pending = self._pending, []
+        for i in range(0, len(rows), self.batch_size):
+            self._insert_many(self.query_iksr_data, rows[i:i + self.batch_size])
+
+    def _insert_many(self, query: str, rows: typing.List[typing.List]):
+        if not rows:
+            return
+        self._uncommitted.append((query, rows))
+        try:
+            self.cursor.executemany(query, rows)
+        except self.backend.Error as err:
+            # We don't know which rows of the batch were inserted: rollback and
+            # insert everything since the last commit one row at a time, so
+            # that only the faulty rows are rejected.
+            logger.warning(f"Batch of {len(rows)} rows failed ({err}), inserting rows one by one.")
+            self.cnxn.rollback()
+            for _query, _rows in self._uncommitted:
+                for values in _rows:
+                    self._insert(_query, values)
+            self._commit()
+            return
+        self._uncommitted_rows += len(rows)
+        if self._uncommitted_rows >= self.commit_interval:
+            self._commit()
+
+    def _commit(self):
+        self.cnxn.commit()
+        self._uncommitted = []
+        self._uncommitted_rows = 0
+
+    def _insert(self, query: str, values: typing.List) -> bool:
         try:
             self.cursor.execute(query, values)
-            self.cnxn.commit()
-        except pyodbc.IntegrityError as err:
+        except self.backend.IntegrityError as err:
             logger.error(f"Error {err} for query {query} with values {values}")
+            return False
+        return True
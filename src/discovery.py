@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import concurrent.futures
+import contextlib
+import csv
+import html
+import os
+import pathlib
+import re
+import time
+import typing
+
+import loguru
+import requests
+
+from .scheduler import Backoff
+from .session import SessionPool
+
+TABLES_URL = "http://iksr.bafg.de/iksr/tableauxIKSRF.asp?S=1&JA={year}"
+
+# Files written in the results folder
+ALL_PARAMETERS = "all_parameters.txt"
+PARAMETER_YEARS = "parameter_years.csv"
+
+# Code of a parameter in a link of a tables page
+PARAMETER_CODE = re.compile(r"[?&]KG=([^&'\"\s<>#]+)")
+
+
+def find_parameters(page: bytes) -> typing.Set[str]:
+    """
+    Returns the distinct parameter codes (`KG=<code>`) linked from a tables
+    page.
+    """
+    return set(PARAMETER_CODE.findall(html.unescape(page.decode(encoding="latin1"))))
+
+
+@contextlib.contextmanager
+def _replace(path: pathlib.Path, **kwargs) -> typing.Iterator[typing.TextIO]:
+    """
+    Opens a temporary file to write in, which replaces :param:`path` once
+    closed without error.
+    """
+    tmp_path = path.with_name(f"{path.name}.part")
+    with open(str(tmp_path), "w", **kwargs) as tmp_file:
+        yield tmp_file
+    os.replace(str(tmp_path), str(path))
+
+
+class ParameterIndex:
+    """
+    Distinct parameters and the years they exist for.
+
+    Only the years in :attr:`years` were discovered, any parameter may exist
+    for the others.
+    """
+
+    def __init__(self):
+        self.parameters: typing.Dict[str, typing.Set[str]] = {}
+        self.years: typing.Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self.parameters)
+
+    def add(self, year: str, parameters: typing.Iterable[str]) -> None:
+        self.years.add(year)
+        for parameter in parameters:
+            self.parameters.setdefault(parameter, set()).add(year)
+
+    def exists(self, year: str, parameter: str) -> bool:
+        if year not in self.years:
+            return True
+        return year in self.parameters.get(parameter, ())
+
+    def write(self, results: pathlib.Path) -> None:
+        """
+        Writes the parameters in `all_parameters.txt` and the (year, parameter)
+        pairs, including the discovered years without any parameter, in
+        `parameter_years.csv`.
+
+        An existing `all_parameters.txt` is kept if it has more parameters, as
+        the tables pages may have been partly unavailable. Nothing is written
+        if no year was discovered.
+        """
+        if not self.years:
+            loguru.logger.error("No year discovered, the parameters files are kept.")
+            return
+        all_parameters = results / ALL_PARAMETERS
+        previous = all_parameters.read_text().split() if all_parameters.exists() else []
+        if len(self.parameters) < len(previous):
+            loguru.logger.warning(
+                f"{len(self.parameters)} parameters discovered but {len(previous)} in {ALL_PARAMETERS}, it is kept."
+            )
+        else:
+            with _replace(all_parameters) as all_params_file:
+                for parameter in sorted(self.parameters):
+                    all_params_file.write(f"{parameter}\n")
+        with _replace(results / PARAMETER_YEARS, newline="") as years_file:
+            writer = csv.writer(years_file, delimiter=";")
+            writer.writerow(["year", "parameter"])
+            for year in sorted(self.years):
+                writer.writerow([year, ""])
+            for parameter, years in sorted(self.parameters.items()):
+                for year in sorted(years):
+                    writer.writerow([year, parameter])
+
+    @classmethod
+    def read(cls, results: pathlib.Path) -> typing.Optional[ParameterIndex]:
+        """
+        Returns the index written in this :param:`results` folder, if any.
+        """
+        years_path = results / PARAMETER_YEARS
+        if not years_path.exists():
+            return
+        index = cls()
+        with open(str(years_path), "r", newline="") as years_file:
+            reader = csv.reader(years_file, delimiter=";")
+            next(reader)
+            for year, parameter in reader:
+                index.add(year, [parameter] if parameter else [])
+        return index
+
+
+class ParameterDiscovery:
+    """
+    Builds `all_parameters.txt` from the tables page of each year, fetched
+    concurrently over HTTP, instead of the GUI. The years each parameter
+    exists for are kept in `parameter_years.csv`, so that
+    :class:`src.http.HTTPExtractor` only requests existing pairs.
+    """
+
+    def __init__(
+        self,
+        results: pathlib.Path,
+        _min: int,
+        _max: int,
+        url: str = TABLES_URL,
+        max_workers: int = 8,
+        timeout: float = 30,
+        max_retries: int = 3,
+        backoff: typing.Optional[Backoff] = None,
+    ):
+        self.results = results
+        self.years = [str(year) for year in range(_min, _max + 1)]
+        self.url = url
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff or Backoff()
+
+    def run(self) -> ParameterIndex:
+        index = ParameterIndex()
+        self.results.mkdir(parents=True, exist_ok=True)
+        with SessionPool(pool_size=self.max_workers) as session_pool:
+            with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+                futures = {executor.submit(self.discover, session_pool, year): year for year in self.years}
+                for future in concurrent.futures.as_completed(futures):
+                    year = futures[future]
+                    parameters = future.result()
+                    if not parameters:
+                        # An empty page is more likely an error than a year without data.
+                        loguru.logger.error(f"[{year}]: ERROR, parameters not discovered, all of them are kept.")
+                        continue
+                    index.add(year, parameters)
+                    loguru.logger.info(f"[{year}]: {len(parameters)} parameters.")
+        index.write(self.results)
+        pairs = sum(len(years) for years in index.parameters.values())
+        loguru.logger.info(f"{len(index)} parameters and {pairs} (year, parameter) pairs discovered.")
+        return index
+
+    def discover(self, session_pool: SessionPool, year: str) -> typing.Optional[typing.Set[str]]:
+        """
+        Returns the parameters of the tables page of this :param:`year`, or
+        `None` if it can't be fetched.
+        """
+        url = self.url.format(year=year)
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self.backoff.delay(attempt))
+            try:
+                response = session_pool.get(url, timeout=self.timeout)
+            except (requests.Timeout, requests.ConnectionError) as err:
+                loguru.logger.error(f"[{year}]: ERROR, {type(err).__name__}.")
+                continue
+            if response.status_code == 200:
+                return find_parameters(response.content)
+            loguru.logger.error(f"[{year}]: ERROR, status: {response.status_code}")
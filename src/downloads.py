@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import os
+import pathlib
+import threading
+import time
+import typing
+import zipfile
+
+import loguru
+
+try:
+    import watchdog.events
+    import watchdog.observers
+except ImportError:
+    # Without watchdog, the folder is only polled.
+    watchdog = None
+
+
+class DownloadWatcher:
+    """
+    Detects the archives downloaded in :param:`folder`.
+
+    The files already in the folder when the watcher is started, or at the
+    last :meth:`mark`, are ignored, as well as the partial downloads
+    (`.zip.part`, `.zip.crdownload`). An archive is complete when it is a
+    valid zip file and its size didn't change since the previous check.
+    With watchdog installed, filesystem events (inotify on Linux,
+    ReadDirectoryChangesW on Windows) wake the watcher up as soon as a file
+    is written. Otherwise, the folder is scanned every :param:`interval`
+    seconds.
+    """
+
+    def __init__(self, folder: pathlib.Path, suffix: str = ".zip", interval: float = 0.05):
+        self.folder = folder
+        self.suffix = suffix
+        self.interval = interval
+        self._seen: typing.Dict[str, typing.Tuple[int, int]] = {}
+        self._sizes: typing.Dict[str, int] = {}
+        self._event = threading.Event()
+        self._observer = None
+
+    def __enter__(self) -> DownloadWatcher:
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self) -> None:
+        self.mark()
+        if watchdog is None:
+            return
+        watcher = self
+
+        class Handler(watchdog.events.FileSystemEventHandler):
+            def on_any_event(self, event):
+                watcher._event.set()
+
+        self._observer = watchdog.observers.Observer()
+        self._observer.schedule(Handler(), str(self.folder), recursive=False)
+        self._observer.start()
+
+    def stop(self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+    def mark(self) -> None:
+        """
+        Ignores all the files currently in the folder.
+        """
+        self._seen = {entry.name: self._stat(entry) for entry in self._scan()}
+        self._sizes = {}
+
+    def wait(self, timeout: float) -> typing.Optional[pathlib.Path]:
+        """
+        Returns the first archive completed since the last :meth:`mark`, or
+        `None` after :param:`timeout` seconds. This archive is then ignored.
+        """
+        start = time.monotonic()
+        while True:
+            self._event.clear()
+            archive, pending = self._complete()
+            elapsed = time.monotonic() - start
+            if archive is not None:
+                loguru.logger.debug(f"{archive.name}: downloaded after {elapsed:.3f}s.")
+                return archive
+            if elapsed >= timeout:
+                loguru.logger.debug(f"No archive downloaded after {elapsed:.3f}s.")
+                return
+            # Events wake the watcher up, but the folder is still scanned from time to time.
+            interval = self.interval if pending or self._observer is None else 10 * self.interval
+            self._event.wait(min(interval, timeout - elapsed))
+
+    def _scan(self) -> typing.List[os.DirEntry]:
+        with os.scandir(str(self.folder)) as entries:
+            return [e for e in entries if e.is_file() and e.name.lower().endswith(self.suffix)]
+
+    @staticmethod
+    def _stat(entry: os.DirEntry) -> typing.Tuple[int, int]:
+        stat = entry.stat()
+        return stat.st_size, stat.st_mtime_ns
+
+    def _complete(self) -> typing.Tuple[typing.Optional[pathlib.Path], bool]:
+        """
+        Returns the first complete archive, and whether other archives are
+        still being written.
+        """
+        pending = False
+        for entry in self._scan():
+            stat = self._stat(entry)
+            if self._seen.get(entry.name) == stat:
+                continue
+            size, _ = stat
+            # Some browsers create the file empty and rename the partial download over it.
+            previous_size = self._sizes.get(entry.name)
+            self._sizes[entry.name] = size
+            if not size or previous_size != size or not zipfile.is_zipfile(entry.path):
+                pending = True
+                continue
+            self._seen[entry.name] = stat
+            return pathlib.Path(entry.path), pending
+        return None, pending
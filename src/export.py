@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import pathlib
+import typing
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+
+from .database import COLUMNS
+from .database import normalize
+from .extractor import BOOKS
+
+# Names of the columns in the dataset, as in the `iksr_data` table.
+NAMES = {
+    "Station de mesure": "station",
+    "fleuve": "fleuve",
+    "matrice": "matrice",
+    "groupe": "groupe",
+    "paramètres": "parameter",
+    "unité": "unit",
+    "type de prélèvement": "type_prelevement",
+    "année": "annee",
+    "période": "periode",
+    "date": "date",
+    "caractères spécifiques": "caracteres_specifiques",
+    "valeur": "valeur",
+}
+
+# Columns of the CSV files read as text, even when their values look like
+# numbers or are all missing.
+TEXT_COLUMNS = [name for name, column in NAMES.items() if name in COLUMNS and column not in ("annee", "date", "valeur")]
+
+SCHEMA = pa.schema(
+    [
+        ("station", pa.string()),
+        ("fleuve", pa.string()),
+        ("matrice", pa.string()),
+        ("groupe", pa.string()),
+        ("parameter", pa.string()),
+        ("unit", pa.string()),
+        ("type_prelevement", pa.string()),
+        ("annee", pa.int32()),
+        ("periode", pa.string()),
+        ("date", pa.timestamp("ms")),
+        ("caracteres_specifiques", pa.string()),
+        ("valeur", pa.float64()),
+        ("source", pa.string()),
+    ]
+)
+
+
+def get_csv_files(results: pathlib.Path, year: int) -> typing.List[typing.Tuple[str, pathlib.Path]]:
+    """
+    Returns the CSV files extracted for this :param:`year`, from the GUI
+    (`results/<year>/<colour>/`) and from HTTP (`results/http/<year>/`), with
+    the name of their source.
+    """
+    folders = [(book, results / str(year) / book) for book in BOOKS]
+    folders.append(("http", results / "http" / str(year)))
+    return [
+        (source, csv_file)
+        for source, folder in folders
+        if folder.exists()
+        for csv_file in sorted(folder.iterdir())
+        if csv_file.suffix == ".csv"
+    ]
+
+
+class Exporter:
+    """
+    Consolidates the extracted CSV files into a Parquet dataset partitioned by
+    year and matrice, with normalized dates and values.
+    """
+
+    def __init__(
+        self, results: pathlib.Path, _min: int, _max: int, destination: pathlib.Path, compression: str = "zstd"
+    ):
+        assert results.exists(), f"{results} doesn't exist."
+        self.results = results
+        self.years = list(range(_min, _max + 1))
+        self.destination = destination
+        self.compression = compression
+
+    def run(self):
+        self.destination.mkdir(parents=True, exist_ok=True)
+        for year in self.years:
+            table = self.read_year(year)
+            if table is None:
+                continue
+            logger.info(f"{year}: {table.num_rows} rows.")
+            pq.write_to_dataset(
+                table,
+                str(self.destination),
+                partition_cols=["annee", "matrice"],
+                compression=self.compression,
+                existing_data_behavior="delete_matching",
+            )
+
+    def read_year(self, year: int) -> typing.Optional[pa.Table]:
+        frames = []
+        for source, csv_file in get_csv_files(self.results, year):
+            df = pd.read_csv(str(csv_file), sep=";", encoding="latin1", dtype=dict.fromkeys(TEXT_COLUMNS, str))
+            if list(df.columns) != COLUMNS:
+                logger.error(f"Unexpected columns in {csv_file}: {list(df.columns)}.")
+                continue
+            df = normalize(df).rename(columns=NAMES)
+            df["source"] = source
+            frames.append(df)
+        if not frames:
+            return
+        df = pd.concat(frames, ignore_index=True)
+        return pa.Table.from_pandas(df[SCHEMA.names], schema=SCHEMA, preserve_index=False)
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import collections
+import hashlib
+import http.server
+import io
+import random
+import threading
+import time
+import typing
+import urllib.parse
+import zipfile
+
+from .database import COLUMNS
+
+
+class FakeIKSRServer:
+    """
+    Local stand-in for the `dl_zippen.asp` flow of the IKSR website.
+
+    The "generate" page returns a script pointing to `='<zip url>'` and the zip
+    holds a latin-1, semicolon separated CSV file of :param:`rows` rows. Each
+    request waits for the latency of its step, then fails with a 500 status
+    with a probability of :param:`error_rate`, or hangs for :param:`hang`
+    seconds with a probability of :param:`timeout_rate`. Archives have an
+    ETag and `If-None-Match` is honoured.
+    """
+
+    def __init__(
+        self,
+        generate_latency: float = 0.05,
+        download_latency: float = 0.01,
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        hang: float = 30.0,
+        rows: int = 100,
+        seed: typing.Optional[int] = None,
+    ):
+        self.generate_latency = generate_latency
+        self.download_latency = download_latency
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.hang = hang
+        self.rows = rows
+        self.random = random.Random(seed)
+        self.requests: typing.Counter[str] = collections.Counter()
+        self._archives: typing.Dict[typing.Tuple[str, str], bytes] = {}
+        self._mutex = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        """
+        URL template of the "generate" step, as expected by
+        :class:`src.http.HTTPExtractor`.
+        """
+        return f"http://127.0.0.1:{self.port}/iksr/dl_zippen.asp?S=1&JA={{year}}&KG={{parameter}}"
+
+    def __enter__(self) -> FakeIKSRServer:
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def archive(self, year: str, parameter: str) -> bytes:
+        with self._mutex:
+            key = (year, parameter)
+            if key not in self._archives:
+                self._archives[key] = make_archive(year, parameter, self.rows)
+            return self._archives[key]
+
+    def count(self, step: str) -> None:
+        with self._mutex:
+            self.requests[step] += 1
+
+    def outcome(self) -> str:
+        """
+        Draws the outcome of a request: "ok", "error" or "hang".
+        """
+        with self._mutex:
+            draw = self.random.random()
+        if draw < self.error_rate:
+            return "error"
+        if draw < self.error_rate + self.timeout_rate:
+            return "hang"
+        return "ok"
+
+
+def make_archive(year: str, parameter: str, rows: int) -> bytes:
+    lines = [";".join(COLUMNS)]
+    for i in range(rows):
+        day = i % 28 + 1
+        lines.append(
+            f"Station {i % 7};Rhin;eau;métaux;{parameter} en µg/l;ponctuel;{year};{i % 12 + 1};"
+            f"{day:02d}.{i % 12 + 1:02d}.{year};{'<' if i % 5 == 0 else ''};{i},{i % 10}"
+        )
+    content = ("\r\n".join(lines) + "\r\n").encode("latin1")
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr(f"iksr_{year}.csv", content)
+    return buffer.getvalue()
+
+
+def _make_handler(server: FakeIKSRServer) -> typing.Type[http.server.BaseHTTPRequestHandler]:
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            query = urllib.parse.parse_qs(url.query)
+            year = query.get("JA", [""])[0]
+            parameter = query.get("KG", [""])[0]
+            if url.path.endswith("dl_zippen.asp"):
+                step, latency = "generate", server.generate_latency
+            elif url.path == "/zip":
+                step, latency = "download", server.download_latency
+            else:
+                return self._send(404, b"")
+            server.count(step)
+
+            time.sleep(latency)
+            outcome = server.outcome()
+            if outcome == "error":
+                return self._send(500, b"Internal Server Error")
+            if outcome == "hang":
+                time.sleep(server.hang)
+
+            if step == "generate":
+                zip_url = f"http://127.0.0.1:{server.port}/zip?{urllib.parse.urlencode({'JA': year, 'KG': parameter})}"
+                body = f"<script>window.location.href='{zip_url}'</script>".encode("latin1")
+                return self._send(200, body, "text/html")
+            archive = server.archive(year, parameter)
+            etag = f'"{hashlib.md5(archive).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                return self._send(304, b"", headers={"ETag": etag})
+            return self._send(200, archive, "application/zip", {"ETag": etag})
+
+        def _send(
+            self,
+            status: int,
+            body: bytes,
+            content_type: str = "text/plain",
+            headers: typing.Optional[typing.Dict[str, str]] = None,
+        ):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
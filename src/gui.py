@@ -1,27 +1,52 @@
 from __future__ import annotations
 
 import dataclasses
-import os
 import pathlib
-import shutil
 import time
 import typing
 import webbrowser
 
 import loguru
-import pandas as pd
 import pyautogui
+import pyperclip
 import pyscreeze
-import win32clipboard
 
+try:
+    import win32clipboard
+except ImportError:
+    # Not on Windows: the clipboard is read with pyperclip.
+    win32clipboard = None
+
+from .cache import ArchiveCache
+from .downloads import DownloadWatcher
 from .extractor import Extractor
+from .extractor import save_sheet_archive
+from .locator import LOCATOR
+from .wait import appears
+from .wait import changes
+from .wait import disappears
+from .wait import log_waits
+from .wait import wait_for
+
+# Width of the rows of the lists and sheets, from their icon, in pixels
+ROW_WIDTH = 600
 
 
-def open_webbrowser(url):
+def open_webbrowser(url, browser: typing.Optional[str] = None):
     """
-    Opens this :param:`url` in a webbroser.
+    Opens this :param:`url` in a webbroser, the default one or the command
+    line :param:`browser` (see :func:`webbrowser.get`).
     """
-    webbrowser.open_new(url)
+    webbrowser.get(browser).open_new(url)
+
+
+def get_clipboard() -> str:
+    if win32clipboard is None:
+        return pyperclip.paste()
+    win32clipboard.OpenClipboard()
+    data = win32clipboard.GetClipboardData()
+    win32clipboard.CloseClipboard()
+    return data
 
 
 def get_sub_books(book: pathlib.Path) -> typing.List[pathlib.Path]:
@@ -35,6 +60,16 @@ def get_sub_book(books: typing.List[pathlib.Path], value: str) -> pathlib.Path:
     return next(filter(lambda b: value in b.name, books))
 
 
+def click_at(x: int, y: int, settle: float = 0.5) -> None:
+    """
+    Clicks at (:param:`x`, :param:`y`) and waits up to :param:`settle`
+    seconds for the screen to change.
+    """
+    changed = changes()
+    pyautogui.click(x, y)
+    wait_for(changed, settle, name="click")
+
+
 def find_img_on_screen(
     img: pathlib.Path, click: bool = True, on_loop: bool = False, retry: int = 0, max_retries: int = 5, **kwargs
 ) -> bool:
@@ -45,64 +80,55 @@ def find_img_on_screen(
     # Default sleep time
     sleep_time = kwargs.pop("sleep_time", 0.5)
 
-    try:
-        x, y = pyautogui.locateCenterOnScreen(str(img), **kwargs)
-        if not click:
-            return True
-        pyautogui.click(x, y)
-    except TypeError as err:
-        print(f"{img.name}: {err}")
-        return False
-    except pyscreeze.ImageNotFoundException as err:
-        if on_loop:
-            retry += 1
-            if retry > max_retries:
-                print(f"{img.name}: {err}")
-                return False
+    box = LOCATOR.locate(img, **kwargs)
+    if box is None:
+        if on_loop and retry < max_retries:
             time.sleep(sleep_time)
-            return find_img_on_screen(img, click, on_loop, retry, max_retries, **kwargs)
-        print(f"{img.name}: {err}")
+            return find_img_on_screen(img, click, on_loop, retry + 1, max_retries, **kwargs)
+        print(f"{img.name}: not found.")
         return False
+    if click:
+        click_at(*pyautogui.center(box))
     return True
 
 
-def find_imgs_on_screen(img: str, click: bool = True, **kwargs) -> typing.Iterable:
+def find_imgs_on_screen(img: str, click: bool = True, **kwargs) -> typing.List[pyscreeze.Box]:
     # Default confidence
     kwargs.setdefault("confidence", 0.8)
-    # Default sleep time
-    local_kwargs = dict()
-    local_kwargs["sleep_time"] = kwargs.pop("sleep_time", 0.5)
+    # Maximum time to wait for the screen to change after each click
+    settle = kwargs.pop("sleep_time", 0.5)
 
-    results = pyautogui.locateAllOnScreen(img, **kwargs)
+    results = LOCATOR.locate_all(img, **kwargs)
     if click:
         for result in results:
             x, y = pyautogui.center(result)
-            pyautogui.click(x, y)
-            time.sleep(local_kwargs["sleep_time"])
+            click_at(x, y, settle)
     return results
 
 
-def find_one_sub_book(book: Book) -> bool:
-    grey_book = book.grey_sub_book
-    list_minus = book.minus_sub_book
-    list_plus = book.plus_sub_book
-
-    kwargs = {}
-    if "bleu" not in str(book):
-        kwargs["minSearchTime"] = 0.5
-    else:
-        kwargs["on_loop"] = True
-
-    time.sleep(0.5)
-    found_grey = find_img_on_screen(grey_book, **kwargs)
-    found_plus = find_img_on_screen(list_plus, click=False, minSearchTime=0.5)
-    found_minus = find_img_on_screen(list_minus, click=False, minSearchTime=0.5)
+def row(pos: pyscreeze.Box) -> typing.Tuple[int, int, int, int]:
+    """
+    Region of the row of a list or sheet icon, with its label.
+    """
+    return pos.left, pos.top, ROW_WIDTH, pos.height
 
-    return found_grey or found_plus or found_minus
 
+def find_one_sub_book(book: Book) -> bool:
+    grey_book = book.grey_sub_book
 
-class NoNewSheets(Exception):
-    pass
+    # The blue book is the first one, it also waits for the page to load.
+    timeout = 30 if "bleu" in str(book) else 1
+    found = wait_for(
+        appears(grey_book, book.plus_sub_book, book.minus_sub_book, confidence=0.8),
+        timeout,
+        name=f"{book.type} sub book",
+    )
+    if found is None:
+        return False
+    img, box = found
+    if img == grey_book:
+        click_at(*pyautogui.center(box))
+    return True
 
 
 @dataclasses.dataclass
@@ -156,8 +182,21 @@ class Book:
 
 
 class GUIExtractor(Extractor):
-    def __init__(self, url: str, _min: int, _max: int, folder: pathlib.Path, delete_existing: bool = False):
-        super().__init__(url, _min, _max, folder, delete_existing)
+    def __init__(
+        self,
+        url: str,
+        _min: int,
+        _max: int,
+        folder: pathlib.Path,
+        delete_existing: bool = False,
+        cache: typing.Optional[ArchiveCache] = None,
+        download_folder: typing.Optional[pathlib.Path] = None,
+        browser: typing.Optional[str] = None,
+        parameters_file: str = "all_parameters.txt",
+        write_to_file: bool = True,
+    ):
+        super().__init__(url, _min, _max, folder, delete_existing, cache)
+        self.browser = browser
 
         self.urls: typing.List[Url] = [Url(url, str(year)) for year in self.all_years]
         self.urls.reverse()
@@ -179,99 +218,159 @@ class GUIExtractor(Extractor):
         self.close_window = self.folder / "close_window.png"
         self.end_of_list = self.livres_folder / "fin_liste.png"
 
-        self.all_parameters = self.results / "all_parameters.txt"
-        self.parameters: typing.List[str] = []
-        self.all_params_file = open(str(self.all_parameters), "w")
-        self.write_to_file = True
+        self.all_parameters = self.results / parameters_file
+        self.parameters: typing.Set[str] = set()
+        self.write_to_file = write_to_file
+        # The parameters file is only truncated when they are collected again.
+        self.all_params_file: typing.Optional[typing.TextIO] = None
+        if self.write_to_file:
+            self.all_params_file = open(str(self.all_parameters), "w")
+        # Folder where the browser saves the archives
+        self.download_folder = download_folder or self.folder
+        self.download_folder.mkdir(parents=True, exist_ok=True)
+        self.downloads = DownloadWatcher(self.download_folder)
 
         pyscreeze.USE_IMAGE_NOT_FOUND_EXCEPTION = True
 
     def run(self):
-        for url in self.urls:
-            loguru.logger.info(f"Current year is {url.year}.")
-            open_webbrowser(url.url)
-
-            url_folder = self.results / url.year
-            url_folder.mkdir(parents=True, exist_ok=True)
-
-            for _book in self.books:
-                book = Book(url, url_folder, _book)
-
-                list_minus = book.minus_sub_book
-                list_plus = book.plus_sub_book
-
-                if not find_one_sub_book(book):
-                    print(f"{book.type}: Nothing to do.")
+        with self.downloads:
+            for url in self.urls:
+                loguru.logger.info(f"Current year is {url.year}.")
+                open_webbrowser(url.url, self.browser)
+
+                url_folder = self.results / url.year
+                url_folder.mkdir(parents=True, exist_ok=True)
+
+                for _book in self.books:
+                    book = Book(url, url_folder, _book)
+
+                    list_minus = book.minus_sub_book
+                    list_plus = book.plus_sub_book
+
+                    if not find_one_sub_book(book):
+                        print(f"{book.type}: Nothing to do.")
+                        continue
+
+                    wait_for(appears(list_plus, list_minus, confidence=0.95), 2, name="lists")
+                    if not find_imgs_on_screen(str(list_minus), confidence=0.95):
+                        print("Nothing to close.")
+
+                    # Lower the confidence for red books.
+                    if "rouge" in book.type:
+                        confidence = 0.955
+                    else:
+                        confidence = 0.97
+                    # Lists opened and sheets saved for this book
+                    visited: typing.Set[str] = set()
+                    visited_sheets: typing.Set[str] = set()
+                    while True:
+                        pos = self.next_list(list_plus, confidence, visited)
+                        if pos is None:
+                            break
+                        x, y = pyautogui.center(pos)
+                        print(x, y)
+                        click_at(x, y)
+
+                        self.loop_on_sheets(book, visited_sheets)
+
+                        # The list was scrolled down to its last sheets.
+                        pos = self.scroll_up(lambda: LOCATOR.locate(list_minus, confidence=0.95))
+                        if pos is None:
+                            print("Can't close the list.")
+                            continue
+                        click_at(*pyautogui.center(pos))
+                find_img_on_screen(self.close_tab)
+        if self.all_params_file is not None:
+            self.all_params_file.close()
+        log_waits()
+
+    def next_list(
+        self, list_plus: pathlib.Path, confidence: float, visited: typing.Set[str], max_scrolls: int = 100
+    ) -> typing.Optional[pyscreeze.Box]:
+        """
+        Returns the first closed list which isn't in :param:`visited`, and adds
+        it. When all the visible ones were opened, scrolls up until a new one
+        is visible or the screen doesn't change anymore.
+        """
+
+        def find() -> typing.Optional[pyscreeze.Box]:
+            for pos in find_imgs_on_screen(str(list_plus), click=False, confidence=confidence):
+                key = LOCATOR.fingerprint(row(pos))
+                if key not in visited:
+                    visited.add(key)
+                    return pos
+
+        return self.scroll_up(find, max_scrolls)
+
+    def scroll_up(
+        self, find: typing.Callable[[], typing.Optional[pyscreeze.Box]], max_scrolls: int = 100
+    ) -> typing.Optional[pyscreeze.Box]:
+        """
+        Returns the position returned by :param:`find`, scrolling up until it
+        isn't `None` or the screen doesn't change anymore.
+        """
+        for _ in range(max_scrolls):
+            pos = find()
+            if pos is not None:
+                return pos
+            frame = LOCATOR.fingerprint()
+            if not find_img_on_screen(self.monter_liste, minSearchTime=0.5, confidence=0.95):
+                return
+            if LOCATOR.fingerprint() == frame:
+                return
+
+    def loop_on_sheets(self, book: Book, visited: typing.Set[str], go_deeper_by: int = 2, max_pages: int = 1000) -> int:
+        """
+        Saves each sheet of the opened list which isn't in :param:`visited`,
+        the sheets of the book already saved, scrolling down by
+        :param:`go_deeper_by` steps. A sheet is identified by the hash of its
+        row, so that the sheets still visible after a scroll are skipped. The
+        list ends with the `fin_liste` image, or when scrolling doesn't change
+        the screen anymore. Returns the number of sheets saved.
+        """
+        if not find_img_on_screen(self.fiche, click=False, minSearchTime=2, confidence=0.967):
+            return 0
+
+        saved = 0
+        frame: typing.Optional[str] = None
+        for _ in range(max_pages):
+            # Identify the sheets on the same screenshot, before any click.
+            sheets = [
+                (pos, LOCATOR.fingerprint(row(pos)))
+                for pos in find_imgs_on_screen(str(self.fiche), click=False, confidence=0.967)
+            ]
+            x_sheet: typing.Optional[int] = None
+            y_sheet: typing.Optional[int] = None
+            for pos, key in sheets:
+                if key in visited:
                     continue
-
-                time.sleep(1)
-                try:
-                    find_imgs_on_screen(str(list_minus), confidence=0.95)
-                except pyscreeze.ImageNotFoundException:
-                    print("Nothing to close.")
-
-                time.sleep(1)
-
-                # Lower the confidence for red books.
-                if "rouge" in book.type:
-                    confidence = 0.955
-                else:
-                    confidence = 0.97
-                positions = find_imgs_on_screen(str(list_plus), click=False, confidence=confidence)
-                for pos in positions:
-                    x, y = pyautogui.center(pos)
-                    print(x, y)
-                    pyautogui.click(x, y)
-                    time.sleep(0.5)
-
-                    self.loop_on_sheets(book)
-                    time.sleep(0.5)
-
-                    find_img_on_screen(list_minus, confidence=0.95)
-                    time.sleep(0.5)
-            find_img_on_screen(self.close_tab)
-
-    def loop_on_sheets(self, book: Book, deep: int = 0, go_deeper_by: int = 2) -> int:
-        time.sleep(0.5)
-        if find_img_on_screen(self.fiche, click=False, minSearchTime=2, confidence=0.967):
-            # Find each sheet
-            sheet_positions = find_imgs_on_screen(str(self.fiche), click=False, confidence=0.967)
-
-            x_sheet: int = 1
-            y_sheet: int = 1
-            for sheet_pos in sheet_positions:
-                x_sheet, y_sheet = pyautogui.center(sheet_pos)
+                visited.add(key)
+                saved += 1
+                x_sheet, y_sheet = pyautogui.center(pos)
                 print(x_sheet, y_sheet)
-                pyautogui.click(x_sheet, y_sheet)
-                time.sleep(0.5)
+                click_at(x_sheet, y_sheet)
 
                 self.save_sheet(book, x_sheet, y_sheet)
-                time.sleep(0.5)
-            pyautogui.click(x_sheet + 800, y_sheet)
-
-        time.sleep(0.5)
-        if find_img_on_screen(self.end_of_list, click=False, minSearchTime=1, confidence=0.97):
-            raise NoNewSheets
-
-        # Go down
-        try:
-            for _ in range(go_deeper_by):
-                find_img_on_screen(self.descendre_liste, confidence=0.99)
-            new_deep = self.loop_on_sheets(book, deep=deep + go_deeper_by, go_deeper_by=go_deeper_by)
-        except pyscreeze.ImageNotFoundException:
-            print("Can't go deeper.")
-            return deep + go_deeper_by
-        except NoNewSheets:
-            print("No new sheets.")
-            if deep:
-                return deep + go_deeper_by
-            else:
-                new_deep = deep + go_deeper_by
-
-        if deep:
-            return new_deep
-        for _ in range(new_deep):
-            find_img_on_screen(self.monter_liste, confidence=0.95)
+            if x_sheet is not None:
+                click_at(x_sheet + 800, y_sheet)
+
+            if find_img_on_screen(self.end_of_list, click=False, minSearchTime=1, confidence=0.97):
+                print("No new sheets.")
+                break
+
+            # Go down
+            if not all(
+                find_img_on_screen(self.descendre_liste, minSearchTime=0.5, confidence=0.99)
+                for _ in range(go_deeper_by)
+            ):
+                print("Can't go deeper.")
+                break
+            # Both frames are taken with the mouse on the scroll button.
+            previous_frame, frame = frame, LOCATOR.fingerprint()
+            if frame == previous_frame:
+                print("No new sheets.")
+                break
+        return saved
 
     def save_sheet(self, book: Book, x_sheet: int, y_sheet: int, max_retries: int = 10):
         if not self.write_to_file:
@@ -285,21 +384,18 @@ class GUIExtractor(Extractor):
             print(f"No save button for [{x_sheet}, {y_sheet}].")
             return
 
-        time.sleep(0.5)
-        for _ in range(max_retries):
-            if not find_img_on_screen(self.no_data, click=False, minSearchTime=1, confidence=0.97):
-                break
-            time.sleep(0.5)
-        else:
+        if not wait_for(disappears(self.no_data, confidence=0.97), max_retries * 0.5, name="no data"):
             print(f"No data to save for [{x_sheet}, {y_sheet}].")
             return
 
+        # Only the archives downloaded from now on are for this sheet.
+        self.downloads.mark()
         if not self.save_pipeline(on_loop=True, max_retries=3, minSearchTime=2, confidence=0.97):
             return
         self.save_archive(book)
 
-        time.sleep(0.5)
         find_imgs_on_screen(str(self.close_window))
+        wait_for(disappears(self.close_window, confidence=0.8), 1, name="close window")
 
     def _save_all_parameters(self, x_sheet: int, y_sheet: int):
         # Try to find a `save` button.
@@ -313,50 +409,32 @@ class GUIExtractor(Extractor):
         pyautogui.hotkey("ctrl", "c", interval=0.1)
         time.sleep(0.1)
 
-        win32clipboard.OpenClipboard()
-        new_data = win32clipboard.GetClipboardData()
-        win32clipboard.CloseClipboard()
+        new_data = get_clipboard()
 
         parameter = new_data.split("=")[-1]
-        if parameter not in self.parameters:
+        if parameter in self.parameters:
+            loguru.logger.info(f"Parameter {parameter} already exists. URL is {new_data}.\n")
+        elif self.all_params_file is not None:
             self.all_params_file.write(f"{parameter}\n")
             self.all_params_file.flush()
-            self.parameters.append(parameter)
-        else:
-            loguru.logger.info(f"Parameter {parameter} already exists. URL is {new_data}.\n")
+            self.parameters.add(parameter)
 
         time.sleep(0.25)
         find_imgs_on_screen(str(self.close_window))
 
     def save_pipeline(self, **kwargs) -> bool:
-        time.sleep(0.5)
         find_img_on_screen(self.download_compressed, **kwargs)
-        time.sleep(0.5)
         find_img_on_screen(self.click_download, **kwargs)
-        time.sleep(0.5)
         kwargs["confidence"] = 0.98
         find_img_on_screen(self.save_ok, **kwargs)
-        time.sleep(0.5)
         return find_img_on_screen(self.save_file, **kwargs)
 
     def save_archive(self, book: Book) -> None:
-        time.sleep(2)
-        zip_file = next(iter([e for e in self.folder.iterdir() if "zip" in e.suffix]), None)
+        zip_file = self.downloads.wait(timeout=10)
         if not zip_file:
             print(f"Didn't find any zip file for {book.result_folder}")
             return
 
-        shutil.unpack_archive(str(zip_file), str(self.folder))
-        csv_file = next(iter([e for e in self.folder.iterdir() if "csv" in e.suffix]), None)
-
-        df = pd.read_csv(str(csv_file), sep=";", encoding="latin1")
-        param = next(iter([c for c in list(df.columns) if "param" in c]), None)
-        if not param:
-            param = ""
-        else:
-            param = str(df[param][0]).replace(" ", "_").replace(":", "-").replace("/", "").replace("\\", "")
-            param += "_"
-        result_filename = f"{param}_{csv_file.name}"
-        os.replace(str(csv_file), str(book.result_folder / result_filename))
-        if zip_file.exists():
-            zip_file.unlink()
+        if save_sheet_archive(self.cache, zip_file.read_bytes(), book.result_folder, book.url.year, book.type) is None:
+            print(f"No CSV file in {zip_file.name} for {book.result_folder}")
+        zip_file.unlink()
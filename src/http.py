@@ -1,33 +1,55 @@
 from __future__ import annotations
 
-import os
+import asyncio
+import concurrent.futures
+import contextlib
+import io
 import pathlib
-import shutil
 import threading
+import time
 import typing
+import zipfile
 
 import loguru
 import requests
 
+from .cache import HTTP
+from .cache import ArchiveCache
+from .cache import extract_csv
+from .discovery import ALL_PARAMETERS
+from .discovery import ParameterIndex
 from .extractor import Extractor
 from .extractor import _free_dir
+from .ledger import Ledger
+from .ledger import payload_checksum
+from .metrics import CACHED
+from .metrics import DONE
+from .metrics import FAILED
+from .metrics import UNCHANGED
+from .metrics import Metrics
+from .scheduler import DOWNLOAD
+from .scheduler import GENERATE
+from .scheduler import AdaptiveLimit
+from .scheduler import AsyncGate
+from .scheduler import Scheduler
+from .session import SessionPool
 
 NBR_MUTEX = 1
 MUTEXES_GENERATE = [threading.Lock() for _ in range(NBR_MUTEX)]
 MUTEXES_DOWNLOAD = [threading.Lock() for _ in range(NBR_MUTEX)]
-MUTEX_LOGGER = threading.Lock()
+
+# Execution modes of :class:`HTTPExtractor`.
+THREADS_MODE = "threads"
+ASYNC_MODE = "async"
+MODES = (THREADS_MODE, ASYNC_MODE)
 
 
 def info(text: str):
-    MUTEX_LOGGER.acquire()
-    loguru.logger.info(text)
-    MUTEX_LOGGER.release()
+    loguru.logger.opt(depth=1).info(text)
 
 
 def error(text: str):
-    MUTEX_LOGGER.acquire()
-    loguru.logger.error(text)
-    MUTEX_LOGGER.release()
+    loguru.logger.opt(depth=1).error(text)
 
 
 class Work:
@@ -43,17 +65,33 @@ class Work:
         parameters: typing.Dict[str, int],
         mutex_generate: threading.Lock,
         mutex_download: threading.Lock,
+        session_pool: SessionPool,
+        ledger: Ledger,
+        scheduler: Scheduler,
+        cache: ArchiveCache,
+        metrics: Metrics,
+        incremental: bool = False,
     ):
         self.result_folder = (result_folder / "http") / year
         if not self.result_folder.exists():
             self.result_folder.mkdir(parents=True, exist_ok=True)
         self.url = url
         self.year = year
-        self.parameters = parameters
-        # Make a copy of the parameters' name
-        self._parameters = list(parameters.keys())
+        # Make a copy of the parameters: the number of retries is per year.
+        self.parameters = dict(parameters)
+        self.ledger = ledger
+        self.scheduler = scheduler
+        self.cache = cache
+        self.metrics = metrics
+        # In incremental mode, jobs already done are checked again.
+        self.incremental = incremental
+        # Parameters whose job is not done yet
+        self._parameters = self.ledger.pending(self.year, self.parameters.keys(), include_done=incremental)
+        # CSV files written during this run
+        self.changed_files: typing.List[pathlib.Path] = []
         self.mutex_generate = mutex_generate
         self.mutex_download = mutex_download
+        self.session_pool = session_pool
         # Maximum of retry for each parameter
         self.max_retry: int = 5
 
@@ -62,83 +100,370 @@ class Work:
 
     def run(self):
         for parameter in self._parameters:
-            result_content = self.download_parameter(parameter)
-            if result_content:
-                self.save_parameter_result(parameter, result_content)
+            self.ledger.start(self.year, parameter)
+            if self.restore_from_cache(parameter):
+                continue
+            response = self.download_parameter(parameter)
+            if response is not None:
+                self.save_response(parameter, response)
 
-    def download_parameter(self, parameter: str) -> typing.Optional[bytes]:
+    def download_parameter(self, parameter: str) -> typing.Optional[requests.Response]:
         """
         Download an HTTP content for a given :param:`parameter.
         """
-        response = self.get(self.get_url_for(parameter), parameter, self.mutex_generate, timeout=5)
-        if not response:
+        response = self.get(self.get_url_for(parameter), parameter, self.mutex_generate, GENERATE)
+        if response is None:
+            return
+        url = get_archive_url(response.content)
+        return self.get(url, parameter, self.mutex_download, DOWNLOAD, headers=self.conditional_headers(parameter))
+
+    def conditional_headers(self, parameter: str) -> typing.Dict[str, str]:
+        """
+        Returns the headers asking the server to send the archive of this
+        :param:`parameter` only if it changed since the last download.
+        """
+        if not self.incremental:
+            return {}
+        _, etag, last_modified = self.ledger.validators(self.year, parameter)
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def save_response(self, parameter: str, response: requests.Response) -> None:
+        """
+        Saves the archive of :param:`response` and records it in the ledger.
+        In incremental mode, an archive whose CSV file did not change is neither
+        unpacked nor saved again.
+        """
+        job = self.metrics.job(self.year, parameter)
+        if self.incremental:
+            previous_checksum, _, _ = self.ledger.validators(self.year, parameter)
+            if response.status_code == 304 or previous_checksum == payload_checksum(response.content):
+                self.ledger.unchanged(self.year, parameter)
+                job.status = UNCHANGED
+                info(f"[{self.year}, {parameter}]: unchanged.")
+                return
+        start = time.monotonic()
+        csv_file = self.save_parameter_result(parameter, response.content)
+        job.save += time.monotonic() - start
+        if csv_file is None:
+            self.ledger.failed(self.year, parameter)
+            job.status = FAILED
             return
-        response = response.decode(encoding="latin1")
-        url = response.split("='")[-1].split("'")[0]
-        return self.get(url, parameter, self.mutex_download)
+        job.status = DONE
+        self.cache.put(HTTP, self.year, parameter, response.content, f"http/{self.year}/{csv_file.name}")
+        self.changed_files.append(csv_file)
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        self.ledger.done(self.year, parameter, response.content, etag, last_modified)
+
+    def restore_from_cache(self, parameter: str) -> bool:
+        """
+        Saves the cached archive of this :param:`parameter`, if any, instead of
+        downloading it. Cached archives are not used in incremental mode as
+        they may be outdated.
+        """
+        if self.incremental:
+            return False
+        result_content = self.cache.get(HTTP, self.year, parameter)
+        if result_content is None:
+            return False
+        csv_file = self.save_parameter_result(parameter, result_content)
+        if csv_file is None:
+            return False
+        info(f"[{self.year}, {parameter}]: restored from the cache.")
+        self.metrics.job(self.year, parameter).status = CACHED
+        self.changed_files.append(csv_file)
+        self.ledger.done(self.year, parameter, result_content)
+        return True
 
     def retry(self, parameter: str) -> None:
         """
         If the number of retries for this :param:`parameter` is less than
         :attr:`Work.max_retry`, retry.
         """
-        parameter_step = self.parameters[parameter] + 1
-        if parameter_step <= self.max_retry:
+        self.parameters[parameter] += 1
+        if self.parameters[parameter] <= self.max_retry:
+            self.metrics.job(self.year, parameter).retries += 1
+            time.sleep(self.scheduler.retry_delay(self.parameters[parameter]))
             self._parameters.append(parameter)
+        else:
+            self.give_up(parameter)
+
+    def give_up(self, parameter: str) -> None:
+        self.ledger.failed(self.year, parameter)
+        self.metrics.job(self.year, parameter).status = FAILED
+        error(f"[{self.year}, {parameter}]: ERROR, gave up after {self.max_retry + 1} attempts.")
+
+    def get(
+        self, url: str, parameter: str, mutex: threading.Lock, stage: str, **kwargs
+    ) -> typing.Optional[requests.Response]:
+        time.sleep(self.scheduler.wait())
+        response = self.fetch(url, parameter, mutex, stage, **kwargs)
+        if response is None:
+            return self.retry(parameter)
+        return response
 
-    def get(self, url: str, parameter: str, mutex: threading.Lock, **kwargs) -> typing.Optional[bytes]:
-        with mutex:
+    def fetch(
+        self, url: str, parameter: str, mutex: typing.Optional[threading.Lock], stage: str, **kwargs
+    ) -> typing.Optional[requests.Response]:
+        """
+        Fetches :param:`url` once and returns the response, or `None` if the
+        request failed. Nothing is scheduled for a retry here but the outcome
+        is reported to the scheduler and to the metrics.
+        """
+        job = self.metrics.job(self.year, parameter)
+        start = time.monotonic()
+        with mutex or contextlib.nullcontext():
+            job.queue_wait += time.monotonic() - start
+            start = time.monotonic()
             try:
-                response = requests.get(url, timeout=kwargs.get("timeout", 5))
-            except requests.exceptions.ReadTimeout:
-                return self.retry(parameter)
+                response = self.session_pool.get(
+                    url, timeout=self.scheduler.timeout(stage), headers=kwargs.get("headers")
+                )
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as err:
+                latency = time.monotonic() - start
+                setattr(job, stage, getattr(job, stage) + latency)
+                self.scheduler.record(latency, ok=False)
+                error(f"[{self.year}, {parameter}]: ERROR, {type(err).__name__} during {stage}.")
+                return
+        latency = time.monotonic() - start
+        setattr(job, stage, getattr(job, stage) + latency)
+        job.bytes += len(response.content)
+        self.scheduler.record(latency, ok=response.status_code in (200, 304))
+        if response.status_code == 304:
+            info(f"[{self.year}, {parameter}]: OK. Not modified.")
+            return response
         if response.status_code != 200:
             error(f"[{self.year}, {parameter}]: ERROR, status: {response.status_code}")
-            return self.retry(parameter)
-        else:
-            response_content = response.content
-            info(f"[{self.year}, {parameter}]: OK. Result size is {len(response_content)}.")
-            return response_content
+            return
+        info(f"[{self.year}, {parameter}]: OK. Result size is {len(response.content)}.")
+        return response
 
-    def save_parameter_result(self, parameter: str, result_content: bytes) -> None:
+    def save_parameter_result(self, parameter: str, result_content: bytes) -> typing.Optional[pathlib.Path]:
         """
         For a given :param:`parameter`, uncompresses its content
-        :param:`result_content` and saves it.
+        :param:`result_content` and saves it. Returns the path of the CSV
+        file, or `None` if the archive is not valid.
         """
-        # Create a zip file with the bytes from :param:`result_content` and
-        # unzip it.
-        zip_filename = self.result_folder / f"{parameter}.zip"
-        with open(str(zip_filename), "wb") as zip_file:
-            zip_file.write(result_content)
-        shutil.unpack_archive(str(zip_filename), str(self.result_folder))
-        if zip_filename.exists():
-            zip_filename.unlink()
+        # Read the archive from memory and stream its CSV file to its final
+        # name, with the :param:`parameter` in the filename.
+        try:
+            with zipfile.ZipFile(io.BytesIO(result_content)) as zip_file:
+                result_file = extract_csv(zip_file, lambda name: self.result_folder / f"{parameter}_{name}")
+        except zipfile.BadZipFile as err:
+            error(f"[{self.year}, {parameter}]: ERROR, {err}.")
+            return
+        if result_file is None:
+            error(f"[{self.year}, {parameter}]: ERROR, no CSV file in the archive.")
+        return result_file
+
+
+def get_archive_url(generate_content: bytes) -> str:
+    """
+    Returns the URL of the zip archive referenced by the page returned from the
+    "generate" step (`...='<zip url>'...`).
+    """
+    response = generate_content.decode(encoding="latin1")
+    return response.split("='")[-1].split("'")[0]
+
+
+def read_jobs(results: pathlib.Path, years: typing.Iterable[int]) -> typing.Dict[str, typing.Dict[str, int]]:
+    """
+    Returns the parameters to request for each of the :param:`years`: those
+    of `all_parameters.txt`, restricted to the (year, parameter) pairs found
+    by the discovery if it was run.
+    """
+    all_parameters = results / ALL_PARAMETERS
+    parameters: typing.Dict[str, int] = {}
+    with open(str(all_parameters), "r") as all_params_file:
+        for parameter in all_params_file.readlines():
+            parameter = parameter.replace("\n", "")
+            parameters[parameter] = 0
+    index = ParameterIndex.read(results)
+
+    jobs: typing.Dict[str, typing.Dict[str, int]] = {}
+    for year in years:
+        jobs[str(year)] = parameters
+        if index is not None:
+            jobs[str(year)] = {p: 0 for p in parameters if index.exists(str(year), p)}
+    return jobs
+
+
+class AsyncEngine:
+    """
+    Runs every (year, parameter) job of several :class:`Work` from a single
+    event loop.
+
+    Blocking requests are executed in a thread pool which is never bigger than
+    :param:`max_in_flight`. :param:`max_generate` and :param:`max_download`
+    limit the number of concurrent requests for each step. Within those
+    bounds, the :param:`scheduler` decides how many requests are in flight and
+    when they are sent.
+    """
+
+    def __init__(
+        self,
+        works: typing.List[Work],
+        scheduler: Scheduler,
+        max_in_flight: int = 8,
+        max_generate: int = 4,
+        max_download: int = 4,
+    ):
+        assert max_in_flight > 0, f"max_in_flight must be positive, got {max_in_flight}."
+        self.works = works
+        self.scheduler = scheduler
+        self.max_in_flight = max_in_flight
+        self.max_generate = max_generate
+        self.max_download = max_download
+
+    def run(self) -> None:
+        asyncio.run(self._run())
+
+    async def _run(self) -> None:
+        # Semaphores must be created inside the running loop.
+        self._in_flight = AsyncGate(self.scheduler.limit)
+        self._generate = asyncio.Semaphore(self.max_generate)
+        self._download = asyncio.Semaphore(self.max_download)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            self._executor = executor
+            await asyncio.gather(*[self._job(work, parameter) for work in self.works for parameter in work._parameters])
+
+    async def _job(self, work: Work, parameter: str) -> None:
+        work.ledger.start(work.year, parameter)
+        if await self._call(work.restore_from_cache, parameter):
+            return
+        for attempt in range(work.max_retry + 1):
+            await asyncio.sleep(self.scheduler.retry_delay(attempt))
+            if attempt:
+                work.ledger.start(work.year, parameter)
+                work.metrics.job(work.year, parameter).retries += 1
+            response = await self._fetch(GENERATE, work, work.get_url_for(parameter), parameter)
+            if response is None:
+                continue
+            url = get_archive_url(response.content)
+            headers = work.conditional_headers(parameter)
+            response = await self._fetch(DOWNLOAD, work, url, parameter, headers=headers)
+            if response is None:
+                continue
+            await self._call(work.save_response, parameter, response)
+            return
+        work.give_up(parameter)
 
-        # Rename CSV file with the :param:`parameter` in the filename.
-        csv_file = next(iter([e for e in self.result_folder.iterdir() if "csv" in e.suffix]), None)
-        result_filename = f"{parameter}_{csv_file.name}"
-        os.replace(str(csv_file), str(self.result_folder / result_filename))
+    async def _fetch(
+        self, stage: str, work: Work, url: str, parameter: str, **kwargs
+    ) -> typing.Optional[requests.Response]:
+        stage_semaphore = self._generate if stage == GENERATE else self._download
+        start = time.monotonic()
+        async with stage_semaphore, self._in_flight:
+            work.metrics.job(work.year, parameter).queue_wait += time.monotonic() - start
+            await asyncio.sleep(self.scheduler.wait())
+            return await self._call(work.fetch, url, parameter, None, stage, **kwargs)
+
+    async def _call(self, func: typing.Callable, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, lambda: func(*args, **kwargs))
 
 
 class HTTPExtractor(Extractor):
-    def __init__(self, url: str, _min: int, _max: int, folder: pathlib.Path, delete_existing: bool = False):
-        super().__init__(url, _min, _max, folder, delete_existing)
+    def __init__(
+        self,
+        url: str,
+        _min: int,
+        _max: int,
+        folder: pathlib.Path,
+        delete_existing: bool = False,
+        mode: str = THREADS_MODE,
+        max_in_flight: int = 8,
+        max_generate: int = 4,
+        max_download: int = 4,
+        pool_size: int = 10,
+        keep_alive: bool = True,
+        incremental: bool = False,
+        scheduler: typing.Optional[Scheduler] = None,
+        cache: typing.Optional[ArchiveCache] = None,
+    ):
+        super().__init__(url, _min, _max, folder, delete_existing, cache)
+        self.metrics = Metrics()
+        assert mode in MODES, f"Unknown mode {mode}, expected one of {MODES}."
+        self.mode = mode
+        self.max_in_flight = max_in_flight
+        self.max_generate = max_generate
+        self.max_download = max_download
+        self.scheduler = scheduler or Scheduler(limit=AdaptiveLimit(maximum=max_in_flight))
+        # Connections are shared between all the works.
+        self.session_pool = SessionPool(pool_size=pool_size, keep_alive=keep_alive)
+        # Jobs already done by a previous run are skipped.
+        self.ledger = Ledger(self.results / "http" / "ledger.sqlite")
 
-        all_parameters = self.results / "all_parameters.txt"
-        parameters: typing.Dict[str, int] = {}
-        with open(str(all_parameters), "r") as all_params_file:
-            for parameter in all_params_file.readlines():
-                parameter = parameter.replace("\n", "")
-                parameters[parameter] = 0
+        jobs = read_jobs(self.results, self.all_years)
 
         self.works: typing.List[Work] = []
         for i, year in enumerate(self.all_years):
             mutex_generate = MUTEXES_GENERATE[i % NBR_MUTEX]
             mutex_download = MUTEXES_DOWNLOAD[i % NBR_MUTEX]
-            work = Work(self.results, url, str(year), parameters, mutex_generate, mutex_download)
+            work = Work(
+                self.results,
+                url,
+                str(year),
+                jobs[str(year)],
+                mutex_generate,
+                mutex_download,
+                self.session_pool,
+                self.ledger,
+                self.scheduler,
+                self.cache,
+                self.metrics,
+                incremental,
+            )
             self.works.append(work)
 
     def run(self):
+        # Closed at the end of the previous run, if any.
+        self.ledger.open()
+        info(f"Jobs: {self.ledger.count()}.")
+        self.metrics.start = time.monotonic()
+        with self.session_pool, self.ledger:
+            if self.mode == ASYNC_MODE:
+                engine = AsyncEngine(
+                    self.works, self.scheduler, self.max_in_flight, self.max_generate, self.max_download
+                )
+                engine.run()
+            else:
+                self._run_threads()
+            info(f"HTTP connections: {self.session_pool.stats}.")
+            info(f"Jobs: {self.ledger.count()}.")
+        self.write_changed_files()
+        self.write_metrics()
+
+    def write_metrics(self) -> None:
+        """
+        Writes the summary of the run in `results/http/metrics.json` and the
+        metrics of each job in `results/http/metrics.csv`.
+        """
+        http_folder = self.results / "http"
+        summary = self.metrics.write(http_folder / "metrics.json", http_folder / "metrics.csv")
+        info(
+            f"{summary['jobs']} jobs in {summary['duration']:.1f}s: {summary['status']}, "
+            f"p50 {summary['latency']['p50']:.2f}s, p95 {summary['latency']['p95']:.2f}s, "
+            f"p99 {summary['latency']['p99']:.2f}s, queue wait {summary['queue_wait']['total']:.1f}s."
+        )
+
+    def write_changed_files(self) -> None:
+        """
+        Writes the CSV files saved during this run in
+        `results/http/changed_files.txt`, so that loaders only read those.
+        """
+        changed_files = [csv_file for work in self.works for csv_file in work.changed_files]
+        with open(str(self.results / "http" / "changed_files.txt"), "w") as changed_files_file:
+            for csv_file in changed_files:
+                changed_files_file.write(f"{csv_file}\n")
+        info(f"{len(changed_files)} changed files.")
+
+    def _run_threads(self):
         threads: typing.List[threading.Thread] = []
         for work in self.works:
             thread = threading.Thread(target=work.run)
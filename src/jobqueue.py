@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import pathlib
+import sqlite3
+import threading
+import time
+import typing
+
+# Status of a job in the queue
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """
+    Queue of the (year, parameter) jobs of a sharded crawl, shared by the
+    worker processes of one or more machines through a SQLite file.
+
+    A worker leases jobs for :param:`lease_duration` seconds and renews its
+    leases while it works on them. The jobs of a dead worker are leased again
+    by the others once their lease expired, at most :param:`max_attempts`
+    times. The file uses a rollback journal rather than WAL, which doesn't
+    work on network filesystems, and the clocks of the machines are expected
+    to be synchronized.
+    """
+
+    def __init__(self, path: pathlib.Path, lease_duration: float = 300, max_attempts: int = 3, timeout: float = 60):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.lease_duration = lease_duration
+        self.max_attempts = max_attempts
+        self._mutex = threading.Lock()
+        # Transactions are explicit.
+        self._cnxn = sqlite3.connect(str(path), timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._cnxn.execute("pragma journal_mode=delete")
+        self._cnxn.execute(
+            "create table if not exists jobs ("
+            "year text not null, "
+            "parameter text not null, "
+            "status text not null, "
+            "owner text, "
+            "lease_expires real, "
+            "attempts integer not null default 0, "
+            "primary key (year, parameter))"
+        )
+        self._cnxn.execute("create index if not exists jobs_status on jobs(status, lease_expires)")
+
+    def __enter__(self) -> JobQueue:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        with self._mutex:
+            self._cnxn.close()
+
+    def _transaction(self, queries: typing.Callable[[sqlite3.Connection], typing.Any]) -> typing.Any:
+        # `begin immediate` takes the write lock at once, so that two workers
+        # never lease the same job.
+        with self._mutex:
+            self._cnxn.execute("begin immediate")
+            try:
+                result = queries(self._cnxn)
+            except BaseException:
+                self._cnxn.execute("rollback")
+                raise
+            self._cnxn.execute("commit")
+        return result
+
+    def add(self, jobs: typing.Iterable[typing.Tuple[str, str]]) -> int:
+        """
+        Adds the (year, parameter) :param:`jobs` which aren't in the queue yet
+        and returns how many were added.
+        """
+        jobs = list(jobs)
+
+        def queries(cnxn):
+            before = cnxn.execute("select count(*) from jobs").fetchone()[0]
+            cnxn.executemany(
+                "insert or ignore into jobs(year, parameter, status) values (?, ?, ?)",
+                [(year, parameter, PENDING) for year, parameter in jobs],
+            )
+            return cnxn.execute("select count(*) from jobs").fetchone()[0] - before
+
+        return self._transaction(queries)
+
+    def lease(self, owner: str, count: int = 1) -> typing.List[typing.Tuple[str, str]]:
+        """
+        Leases up to :param:`count` pending or expired jobs to :param:`owner`
+        and returns them. Expired jobs leased too many times already are
+        failed instead.
+        """
+
+        def queries(cnxn):
+            now = time.time()
+            cnxn.execute(
+                "update jobs set status = ?, owner = null, lease_expires = null "
+                "where status = ? and lease_expires < ? and attempts >= ?",
+                (FAILED, LEASED, now, self.max_attempts),
+            )
+            jobs = cnxn.execute(
+                "select year, parameter from jobs where status = ? or (status = ? and lease_expires < ?) "
+                "order by year, parameter limit ?",
+                (PENDING, LEASED, now, count),
+            ).fetchall()
+            cnxn.executemany(
+                "update jobs set status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                "where year = ? and parameter = ?",
+                [(LEASED, owner, now + self.lease_duration, year, parameter) for year, parameter in jobs],
+            )
+            return jobs
+
+        return self._transaction(queries)
+
+    def renew(self, owner: str, jobs: typing.Iterable[typing.Tuple[str, str]]) -> None:
+        """
+        Extends the leases of :param:`owner` on these :param:`jobs`.
+        """
+        jobs = list(jobs)
+
+        def queries(cnxn):
+            cnxn.executemany(
+                "update jobs set lease_expires = ? where year = ? and parameter = ? and owner = ? and status = ?",
+                [(time.time() + self.lease_duration, year, parameter, owner, LEASED) for year, parameter in jobs],
+            )
+
+        self._transaction(queries)
+
+    def _finish(self, owner: str, year: str, parameter: str, status: str) -> None:
+        def queries(cnxn):
+            cnxn.execute(
+                "update jobs set status = ?, lease_expires = null where year = ? and parameter = ? and owner = ?",
+                (status, year, parameter, owner),
+            )
+
+        self._transaction(queries)
+
+    def done(self, owner: str, year: str, parameter: str) -> None:
+        self._finish(owner, year, parameter, DONE)
+
+    def failed(self, owner: str, year: str, parameter: str) -> None:
+        self._finish(owner, year, parameter, FAILED)
+
+    def release(self, owner: str, year: str, parameter: str) -> None:
+        """
+        Gives a leased job back to the other workers.
+        """
+        self._finish(owner, year, parameter, PENDING)
+
+    def count(self) -> typing.Dict[str, int]:
+        """
+        Returns the number of jobs for each status.
+        """
+        return dict(
+            self._transaction(lambda c: c.execute("select status, count(*) from jobs group by status").fetchall())
+        )
+
+    def remaining(self) -> int:
+        """
+        Returns the number of jobs not done nor failed yet.
+        """
+        return self._transaction(
+            lambda c: c.execute("select count(*) from jobs where status in (?, ?)", (PENDING, LEASED)).fetchone()[0]
+        )
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import datetime
+import hashlib
+import io
+import pathlib
+import sqlite3
+import threading
+import typing
+import zipfile
+
+# Status of a (year, parameter) job.
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def checksum(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def payload_checksum(content: bytes, chunk_size: int = 1 << 20) -> str:
+    """
+    Returns the checksum of the CSV file of the archive :param:`content`,
+    which doesn't depend on the timestamps stored in the archive, or of the
+    :param:`content` itself if it isn't an archive of a CSV file.
+    """
+    try:
+        with zipfile.ZipFile(io.BytesIO(content)) as zip_file:
+            csv_name = next(iter([n for n in zip_file.namelist() if n.lower().endswith(".csv")]), None)
+            if csv_name is None:
+                return checksum(content)
+            sha256 = hashlib.sha256()
+            with zip_file.open(csv_name) as csv_file:
+                for chunk in iter(lambda: csv_file.read(chunk_size), b""):
+                    sha256.update(chunk)
+            return sha256.hexdigest()
+    except zipfile.BadZipFile:
+        return checksum(content)
+
+
+class Ledger:
+    """
+    Thread safe on-disk ledger of the (year, parameter) jobs of an HTTP crawl.
+
+    Every job is stored with its status, its number of attempts and, once done,
+    the size of its archive and the checksum of its CSV file, so that an
+    interrupted crawl can be resumed.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._mutex = threading.Lock()
+        self.closed = True
+        self.open()
+
+    def open(self) -> None:
+        """
+        Connects to the ledger file, unless it is already connected, e.g. to
+        run again after :meth:`close`.
+        """
+        with self._mutex:
+            if not self.closed:
+                return
+            self._cnxn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._cnxn.execute("pragma journal_mode=wal")
+            # The workers of a sharded crawl may open the ledger at the same
+            # time: the schema is checked and migrated under the write lock.
+            self._cnxn.isolation_level = None
+            self._cnxn.execute("begin immediate")
+            try:
+                self._migrate()
+            except BaseException:
+                self._cnxn.execute("rollback")
+                self._cnxn.close()
+                raise
+            self._cnxn.execute("commit")
+            self._cnxn.isolation_level = ""
+            self.closed = False
+
+    def _migrate(self) -> None:
+        self._cnxn.execute(
+            "create table if not exists jobs ("
+            "year text not null, "
+            "parameter text not null, "
+            "status text not null, "
+            "attempts integer not null default 0, "
+            "size integer, "
+            "checksum text, "
+            "updated_at text, "
+            "primary key (year, parameter))"
+        )
+        # Columns added after the first version of the ledger.
+        columns = {row[1] for row in self._cnxn.execute("pragma table_info(jobs)")}
+        for column in ("etag", "last_modified"):
+            if column not in columns:
+                self._cnxn.execute(f"alter table jobs add column {column} text")
+
+    def __enter__(self) -> Ledger:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        with self._mutex:
+            if not self.closed:
+                self._cnxn.close()
+                self.closed = True
+
+    def _execute(self, query: str, values: typing.Sequence = ()) -> typing.List[tuple]:
+        with self._mutex:
+            rows = self._cnxn.execute(query, values).fetchall()
+            self._cnxn.commit()
+        return rows
+
+    def pending(self, year: str, parameters: typing.Iterable[str], include_done: bool = False) -> typing.List[str]:
+        """
+        Registers the jobs of :param:`year` for each of the :param:`parameters`
+        and returns the parameters whose job is not done yet, or all of them if
+        :param:`include_done` is `True`.
+        """
+        parameters = list(parameters)
+        with self._mutex:
+            self._cnxn.executemany(
+                "insert or ignore into jobs(year, parameter, status) values (?, ?, ?)",
+                [(year, parameter, PENDING) for parameter in parameters],
+            )
+            self._cnxn.commit()
+            if include_done:
+                return parameters
+            done = {
+                row[0]
+                for row in self._cnxn.execute("select parameter from jobs where year = ? and status = ?", (year, DONE))
+            }
+        return [parameter for parameter in parameters if parameter not in done]
+
+    def start(self, year: str, parameter: str) -> None:
+        self._execute(
+            "update jobs set status = ?, attempts = attempts + 1, updated_at = ? where year = ? and parameter = ?",
+            (RUNNING, _now(), year, parameter),
+        )
+
+    def done(
+        self,
+        year: str,
+        parameter: str,
+        content: bytes,
+        etag: typing.Optional[str] = None,
+        last_modified: typing.Optional[str] = None,
+    ) -> None:
+        self._execute(
+            "update jobs set status = ?, size = ?, checksum = ?, etag = ?, last_modified = ?, updated_at = ? "
+            "where year = ? and parameter = ?",
+            (DONE, len(content), payload_checksum(content), etag, last_modified, _now(), year, parameter),
+        )
+
+    def unchanged(self, year: str, parameter: str) -> None:
+        """
+        Marks a job as done without touching its archive's information.
+        """
+        self._execute(
+            "update jobs set status = ?, updated_at = ? where year = ? and parameter = ?",
+            (DONE, _now(), year, parameter),
+        )
+
+    def validators(self, year: str, parameter: str) -> typing.Tuple[typing.Optional[str], ...]:
+        """
+        Returns the checksum of the CSV file, the ETag and the Last-Modified
+        date of the last archive downloaded for this job.
+        """
+        rows = self._execute(
+            "select checksum, etag, last_modified from jobs where year = ? and parameter = ?", (year, parameter)
+        )
+        return rows[0] if rows else (None, None, None)
+
+    def failed(self, year: str, parameter: str) -> None:
+        self._execute(
+            "update jobs set status = ?, updated_at = ? where year = ? and parameter = ?",
+            (FAILED, _now(), year, parameter),
+        )
+
+    def status(self, year: str, parameter: str) -> typing.Optional[str]:
+        rows = self._execute("select status from jobs where year = ? and parameter = ?", (year, parameter))
+        return rows[0][0] if rows else None
+
+    def count(self) -> typing.Dict[str, int]:
+        """
+        Returns the number of jobs for each status.
+        """
+        return dict(self._execute("select status, count(*) from jobs group by status"))
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat()
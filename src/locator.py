@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import hashlib
+import pathlib
+import time
+import typing
+
+import cv2
+import numpy as np
+import pyautogui
+import pyscreeze
+
+# (left, top, width, height)
+Region = typing.Tuple[int, int, int, int]
+
+
+def grow(box: Region, margin: int) -> Region:
+    left, top, width, height = box
+    return max(0, left - margin), max(0, top - margin), width + 2 * margin, height + 2 * margin
+
+
+def union(a: Region, b: Region) -> Region:
+    left = min(a[0], b[0])
+    top = min(a[1], b[1])
+    right = max(a[0] + a[2], b[0] + b[2])
+    bottom = max(a[1] + a[3], b[1] + b[3])
+    return left, top, right - left, bottom - top
+
+
+class Locator:
+    """
+    Template matching on the screen, cheaper than
+    :func:`pyautogui.locateOnScreen`:
+
+    - templates are decoded once and kept in memory;
+    - a screenshot is shared by all the lookups of a same UI step, until
+      :meth:`invalidate` is called (after a click) or it is older than
+      :param:`max_age` seconds;
+    - a single template is first searched in the region where it was already
+      found, grown by :param:`margin` pixels, and on the whole screen
+      otherwise. All the matches of a template (e.g. the sheets of the list)
+      are always searched on the whole screen, as some may be out of that
+      region.
+    """
+
+    def __init__(self, max_age: float = 0.25, margin: int = 50):
+        self.max_age = max_age
+        self.margin = margin
+        self._templates: typing.Dict[str, np.ndarray] = {}
+        self._regions: typing.Dict[str, Region] = {}
+        self._screenshot: typing.Optional[np.ndarray] = None
+        self._taken = 0.0
+
+    def template(self, img: typing.Union[str, pathlib.Path]) -> np.ndarray:
+        key = str(img)
+        if key not in self._templates:
+            template = cv2.imread(key, cv2.IMREAD_COLOR)
+            assert template is not None, f"{img} can't be read."
+            self._templates[key] = template
+        return self._templates[key]
+
+    def screenshot(self) -> np.ndarray:
+        if self._screenshot is None or time.monotonic() - self._taken > self.max_age:
+            self._screenshot = cv2.cvtColor(np.array(pyautogui.screenshot()), cv2.COLOR_RGB2BGR)
+            self._taken = time.monotonic()
+        return self._screenshot
+
+    def invalidate(self) -> None:
+        """
+        Forgets the current screenshot, to be called each time the screen
+        changes.
+        """
+        self._screenshot = None
+
+    def fingerprint(self, region: typing.Optional[Region] = None) -> str:
+        """
+        Hash of the dark pixels of :param:`region` of the screen, or of the
+        whole screen. Only the text and the icons count, not their colour
+        (e.g. of the visited links).
+        """
+        screenshot = self.screenshot()
+        if region is not None:
+            left, top, width, height = region
+            screenshot = screenshot[top : top + height, left : left + width]
+        dark = screenshot.mean(axis=2) < 128
+        return hashlib.sha1(str(dark.shape).encode() + np.packbits(dark).tobytes()).hexdigest()
+
+    def locate(
+        self,
+        img: typing.Union[str, pathlib.Path],
+        minSearchTime: float = 0,
+        confidence: float = 0.999,
+        grayscale: bool = False,
+    ) -> typing.Optional[pyscreeze.Box]:
+        """
+        Returns the position of :param:`img` on the screen, polling new
+        screenshots for up to :param:`minSearchTime` seconds. Returns `None`
+        if it isn't found.
+        """
+        start = time.monotonic()
+        while True:
+            boxes = self._search(img, False, confidence, grayscale)
+            if boxes:
+                return boxes[0]
+            if time.monotonic() - start >= minSearchTime:
+                return
+            self.invalidate()
+
+    def locate_all(
+        self, img: typing.Union[str, pathlib.Path], confidence: float = 0.999, grayscale: bool = False
+    ) -> typing.List[pyscreeze.Box]:
+        return self._search(img, True, confidence, grayscale)
+
+    def _search(
+        self, img: typing.Union[str, pathlib.Path], find_all: bool, confidence: float, grayscale: bool
+    ) -> typing.List[pyscreeze.Box]:
+        key = str(img)
+        needle = self.template(img)
+        haystack = self.screenshot()
+        boxes: typing.List[pyscreeze.Box] = []
+        if key in self._regions and not find_all:
+            boxes = self._match(needle, haystack, self._regions[key], find_all, confidence, grayscale)
+        if not boxes:
+            screen = (0, 0, haystack.shape[1], haystack.shape[0])
+            boxes = self._match(needle, haystack, screen, find_all, confidence, grayscale)
+        if boxes:
+            self._learn(key, boxes, find_all, haystack.shape[0])
+        return boxes
+
+    @staticmethod
+    def _match(
+        needle: np.ndarray, haystack: np.ndarray, region: Region, find_all: bool, confidence: float, grayscale: bool
+    ) -> typing.List[pyscreeze.Box]:
+        left, top, width, height = region
+        crop = haystack[top : top + height, left : left + width]
+        if crop.shape[0] < needle.shape[0] or crop.shape[1] < needle.shape[1]:
+            return []
+        try:
+            boxes = list(
+                pyscreeze.locateAll(
+                    needle, crop, limit=10000 if find_all else 1, confidence=confidence, grayscale=grayscale
+                )
+            )
+        except pyscreeze.ImageNotFoundException:
+            return []
+        return [pyscreeze.Box(b.left + left, b.top + top, b.width, b.height) for b in boxes]
+
+    def _learn(self, key: str, boxes: typing.List[pyscreeze.Box], find_all: bool, screen_height: int) -> None:
+        region = tuple(boxes[0])
+        for box in boxes[1:]:
+            region = union(region, tuple(box))
+        region = grow(region, self.margin)
+        if find_all:
+            # The whole column, as the list scrolls.
+            region = (region[0], 0, region[2], screen_height)
+        if key in self._regions:
+            region = union(self._regions[key], region)
+        self._regions[key] = region
+
+
+# Shared by all the lookups of the GUI crawl.
+LOCATOR = Locator()
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import csv
+import dataclasses
+import json
+import math
+import pathlib
+import threading
+import time
+import typing
+
+# Final status of a job
+DONE = "done"
+FAILED = "failed"
+UNCHANGED = "unchanged"
+CACHED = "cached"
+
+
+@dataclasses.dataclass
+class JobMetrics:
+    """
+    Metrics of a (year, parameter) job. Times are in seconds and summed over
+    all the attempts of the job.
+    """
+
+    year: str
+    parameter: str
+    generate: float = 0.0
+    download: float = 0.0
+    save: float = 0.0
+    queue_wait: float = 0.0
+    bytes: int = 0
+    retries: int = 0
+    status: str = ""
+
+    @property
+    def latency(self) -> float:
+        return self.generate + self.download + self.save
+
+
+def percentile(values: typing.List[float], rank: float) -> float:
+    """
+    Nearest-rank percentile of :param:`values`, with :param:`rank` between 0
+    and 100.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = max(0, math.ceil(rank / 100 * len(values)) - 1)
+    return values[index]
+
+
+class Metrics:
+    """
+    Thread safe collection of the :class:`JobMetrics` of a run.
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self._jobs: typing.Dict[typing.Tuple[str, str], JobMetrics] = {}
+        self._mutex = threading.Lock()
+
+    def job(self, year: str, parameter: str) -> JobMetrics:
+        with self._mutex:
+            key = (year, parameter)
+            if key not in self._jobs:
+                self._jobs[key] = JobMetrics(year, parameter)
+            return self._jobs[key]
+
+    @property
+    def jobs(self) -> typing.List[JobMetrics]:
+        with self._mutex:
+            return list(self._jobs.values())
+
+    def summary(self, slowest: int = 10) -> typing.Dict[str, typing.Any]:
+        jobs = self.jobs
+        duration = time.monotonic() - self.start
+        total_bytes = sum(job.bytes for job in jobs)
+        summary: typing.Dict[str, typing.Any] = {
+            "duration": duration,
+            "jobs": len(jobs),
+            "status": {},
+            "bytes": total_bytes,
+            "retries": sum(job.retries for job in jobs),
+            "jobs_per_second": len(jobs) / duration if duration else 0.0,
+            "bytes_per_second": total_bytes / duration if duration else 0.0,
+        }
+        for job in jobs:
+            summary["status"][job.status] = summary["status"].get(job.status, 0) + 1
+        for phase in ("generate", "download", "save", "queue_wait", "latency"):
+            values = [getattr(job, phase) for job in jobs]
+            summary[phase] = {
+                "total": sum(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+            }
+        # Mean latency of each parameter, over all years
+        latencies: typing.Dict[str, typing.List[float]] = {}
+        for job in jobs:
+            latencies.setdefault(job.parameter, []).append(job.latency)
+        means = {parameter: sum(values) / len(values) for parameter, values in latencies.items()}
+        summary["slowest_parameters"] = sorted(means.items(), key=lambda item: item[1], reverse=True)[:slowest]
+        return summary
+
+    def write(self, json_path: pathlib.Path, csv_path: pathlib.Path) -> typing.Dict[str, typing.Any]:
+        """
+        Writes the summary of the run in :param:`json_path` and the metrics of
+        each job in :param:`csv_path`. Returns the summary.
+        """
+        summary = self.summary()
+        with open(str(json_path), "w") as json_file:
+            json.dump(summary, json_file, indent=4)
+        fields = [field.name for field in dataclasses.fields(JobMetrics)] + ["latency"]
+        with open(str(csv_path), "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(fields)
+            for job in self.jobs:
+                writer.writerow([getattr(job, field) for field in fields])
+        return summary
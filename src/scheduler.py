@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import threading
+import time
+import typing
+
+# Steps of an HTTP job.
+GENERATE = "generate"
+DOWNLOAD = "download"
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket allowing :param:`rate` requests per second, with
+    bursts of up to :param:`capacity` requests.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        assert rate > 0, f"rate must be positive, got {rate}."
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._mutex = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token and returns the time to wait, in seconds, before it can
+        be used.
+        """
+        with self._mutex:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+
+class Backoff:
+    """
+    Exponential backoff with full jitter: before the n-th retry, waits a random
+    time between 0 and `min(max_delay, base * factor ** (n - 1))` seconds.
+    """
+
+    def __init__(self, base: float = 0.5, factor: float = 2.0, max_delay: float = 30.0):
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        if attempt <= 0:
+            return 0.0
+        return random.uniform(0, min(self.max_delay, self.base * self.factor ** (attempt - 1)))
+
+
+class AdaptiveLimit:
+    """
+    Thread safe concurrency limit tuned with an AIMD (additive increase,
+    multiplicative decrease) policy.
+
+    The limit grows by :param:`increase` per window of successful requests
+    faster than :param:`target_latency` and is multiplied by
+    :param:`decrease` on an error or a slow request, at most once per
+    :param:`cooldown` seconds.
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        minimum: int = 1,
+        maximum: int = 8,
+        target_latency: float = 2.0,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        cooldown: float = 1.0,
+    ):
+        assert 0 < minimum <= maximum, f"Invalid bounds [{minimum}, {maximum}]."
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._value = float(min(max(initial, minimum), maximum))
+        self._last_decrease = 0.0
+        self._mutex = threading.Lock()
+
+    @property
+    def value(self) -> int:
+        return int(self._value)
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self._mutex:
+            if ok and latency <= self.target_latency:
+                self._value = min(self.maximum, self._value + self.increase / self._value)
+                return
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self._value = max(self.minimum, self._value * self.decrease)
+
+
+class Scheduler:
+    """
+    Decides when requests to the IKSR website are sent: rate limit, backoff
+    between retries, timeout of each step and concurrency limit.
+    """
+
+    def __init__(
+        self,
+        rate_limit: typing.Optional[TokenBucket] = None,
+        backoff: typing.Optional[Backoff] = None,
+        timeouts: typing.Optional[typing.Dict[str, float]] = None,
+        limit: typing.Optional[AdaptiveLimit] = None,
+    ):
+        self.rate_limit = rate_limit or TokenBucket(rate=20, capacity=10)
+        self.backoff = backoff or Backoff()
+        # The "generate" step builds the archive on the server side and is
+        # much slower than the download.
+        self.timeouts = {GENERATE: 10.0, DOWNLOAD: 5.0}
+        self.timeouts.update(timeouts or {})
+        self.limit = limit or AdaptiveLimit()
+
+    def wait(self) -> float:
+        """
+        Returns the time to wait before sending the next request.
+        """
+        return self.rate_limit.reserve()
+
+    def retry_delay(self, attempt: int) -> float:
+        return self.backoff.delay(attempt)
+
+    def timeout(self, stage: str) -> float:
+        return self.timeouts[stage]
+
+    def record(self, latency: float, ok: bool) -> None:
+        self.limit.record(latency, ok)
+
+
+class AsyncGate:
+    """
+    Asynchronous context manager letting at most `limit.value` coroutines in
+    at the same time, where :param:`limit` may change at any moment.
+    """
+
+    def __init__(self, limit: AdaptiveLimit):
+        self.limit = limit
+        self._count = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self) -> AsyncGate:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._count < self.limit.value)
+            self._count += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        async with self._condition:
+            self._count -= 1
+            self._condition.notify_all()
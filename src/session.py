@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import dataclasses
+import threading
+import typing
+
+import requests
+import requests.adapters
+
+
+@dataclasses.dataclass
+class PoolStats:
+    requests: int = 0
+    new_connections: int = 0
+
+    @property
+    def reused_connections(self) -> int:
+        return self.requests - self.new_connections
+
+    def __str__(self) -> str:
+        return (
+            f"{self.requests} requests, {self.new_connections} new connections, "
+            f"{self.reused_connections} reused connections"
+        )
+
+
+class SessionPool:
+    """
+    Thread safe pool of keep-alive HTTP connections.
+
+    Each thread gets its own :class:`requests.Session` (sessions are not thread
+    safe) but all of them are mounted on a same
+    :class:`requests.adapters.HTTPAdapter`, so the underlying TCP connections
+    are shared. :param:`pool_size` is the maximum number of connections kept
+    open for a host and :param:`pool_hosts` the number of hosts with a pool.
+    When :param:`block` is `True`, no more than :param:`pool_size` connections
+    are ever opened to a same host.
+    """
+
+    def __init__(self, pool_size: int = 10, pool_hosts: int = 4, keep_alive: bool = True, block: bool = True):
+        self.pool_size = pool_size
+        self.pool_hosts = pool_hosts
+        self.keep_alive = keep_alive
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_hosts, pool_maxsize=pool_size, pool_block=block
+        )
+        self._local = threading.local()
+        self._sessions: typing.List[requests.Session] = []
+        self._mutex = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        Returns the session of the current thread.
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", self.adapter)
+            session.mount("https://", self.adapter)
+            if not self.keep_alive:
+                session.headers["Connection"] = "close"
+            self._local.session = session
+            with self._mutex:
+                self._sessions.append(session)
+        return session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.session.get(url, **kwargs)
+
+    @property
+    def stats(self) -> PoolStats:
+        """
+        Number of requests sent and of connections opened so far, for the hosts
+        still in the pool.
+        """
+        stats = PoolStats()
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats.requests += pool.num_requests
+            stats.new_connections += pool.num_connections
+        return stats
+
+    def close(self) -> None:
+        with self._mutex:
+            for session in self._sessions:
+                session.close()
+            self._sessions.clear()
+        self.adapter.close()
+
+    def __enter__(self) -> SessionPool:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
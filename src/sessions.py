@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import concurrent.futures
+import multiprocessing
+import os
+import pathlib
+import shlex
+import subprocess
+import time
+import typing
+
+import loguru
+
+from .extractor import _free_dir
+from .extractor import add_log_sink
+
+# Firefox preferences of a session: downloads go to its own folder, without
+# any dialog.
+FIREFOX_PREFERENCES = """
+user_pref("browser.download.folderList", 2);
+user_pref("browser.download.dir", "{download_folder}");
+user_pref("browser.download.useDownloadDir", true);
+user_pref("browser.helperApps.neverAsk.saveToDisk", "application/zip,application/x-zip-compressed");
+user_pref("browser.shell.checkDefaultBrowser", false);
+"""
+
+
+class VirtualDisplay:
+    """
+    Xvfb server on the display :param:`number`, with a screen of
+    :param:`screen` (`<width>x<height>x<depth>`).
+    """
+
+    def __init__(self, number: int, screen: str = "1920x1080x24", timeout: float = 10):
+        self.number = number
+        self.screen = screen
+        self.timeout = timeout
+        self._process: typing.Optional[subprocess.Popen] = None
+
+    @property
+    def name(self) -> str:
+        return f":{self.number}"
+
+    def __enter__(self) -> VirtualDisplay:
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self) -> None:
+        self._process = subprocess.Popen(
+            ["Xvfb", self.name, "-screen", "0", self.screen, "-nolisten", "tcp"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        socket = pathlib.Path(f"/tmp/.X11-unix/X{self.number}")
+        start = time.monotonic()
+        while not socket.exists():
+            if self._process.poll() is not None:
+                raise RuntimeError(f"Xvfb {self.name} exited with status {self._process.returncode}.")
+            if time.monotonic() - start > self.timeout:
+                self.stop()
+                raise RuntimeError(f"Xvfb {self.name} didn't start in {self.timeout}s.")
+            time.sleep(0.05)
+
+    def stop(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+
+def split_years(_min: int, _max: int, sessions: int) -> typing.List[typing.Tuple[int, int]]:
+    """
+    Splits the years from :param:`_min` to :param:`_max` in at most
+    :param:`sessions` ranges of consecutive years, as even as possible.
+    """
+    years = list(range(_min, _max + 1))
+    sessions = min(sessions, len(years))
+    size, remainder = divmod(len(years), sessions)
+    ranges = []
+    start = 0
+    for i in range(sessions):
+        end = start + size + (1 if i < remainder else 0)
+        ranges.append((years[start], years[end - 1]))
+        start = end
+    return ranges
+
+
+def run_session(
+    index: int,
+    url: str,
+    _min: int,
+    _max: int,
+    folder: pathlib.Path,
+    display: int,
+    screen: str,
+    browser: str,
+    write_to_file: bool = True,
+) -> int:
+    """
+    Runs a :class:`src.gui.GUIExtractor` of the years from :param:`_min` to
+    :param:`_max` on its own virtual display, browser profile and download
+    folder. Returns the index of the session.
+
+    :param write_to_file: see :class:`src.gui.GUIExtractor`.
+    """
+    session_folder = folder / "sessions" / str(index)
+    download_folder = session_folder / "downloads"
+    profile = session_folder / "profile"
+    download_folder.mkdir(parents=True, exist_ok=True)
+    profile.mkdir(parents=True, exist_ok=True)
+    with open(str(profile / "user.js"), "w") as preferences:
+        preferences.write(FIREFOX_PREFERENCES.format(download_folder=download_folder.resolve().as_posix()))
+
+    with VirtualDisplay(display, screen):
+        os.environ["DISPLAY"] = f":{display}"
+        # pyautogui connects to the display when it is imported.
+        from .gui import GUIExtractor
+
+        extractor = GUIExtractor(
+            url,
+            _min,
+            _max,
+            folder,
+            download_folder=download_folder,
+            browser=f"{browser} --profile {shlex.quote(str(profile.resolve()))} --new-tab %s",
+            parameters_file=f"all_parameters_{index}.txt",
+            write_to_file=write_to_file,
+        )
+        loguru.logger.info(f"Session {index}: years {_min} to {_max} on display :{display}.")
+        extractor.run()
+    return index
+
+
+class GUISessions:
+    """
+    Runs the GUI crawl in :param:`sessions` processes, each with its own Xvfb
+    display (from :param:`first_display`), browser and download folder, on a
+    share of the years. All sessions write in the same `results/` tree and
+    cache, and their parameters are merged in `results/all_parameters.txt`.
+    With :param:`write_to_file`, as for :class:`src.gui.GUIExtractor`, the
+    sessions only collect the parameters, otherwise they download the sheets
+    in `results/<year>/<colour>/`.
+
+    Linux only, Xvfb and :param:`browser` (Firefox) must be installed.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        _min: int,
+        _max: int,
+        folder: pathlib.Path,
+        sessions: int = 2,
+        delete_existing: bool = False,
+        browser: str = "firefox",
+        first_display: int = 90,
+        screen: str = "1920x1080x24",
+        write_to_file: bool = True,
+    ):
+        assert sessions > 0, "At least one session is needed."
+        self.url = url
+        self.folder = folder
+        self.results = folder / "results"
+        self.ranges = split_years(_min, _max, sessions)
+        self.browser = browser
+        self.first_display = first_display
+        self.screen = screen
+        self.write_to_file = write_to_file
+
+        if delete_existing:
+            _free_dir(self.results)
+            _free_dir(self.folder / "sessions")
+        self.results.mkdir(parents=True, exist_ok=True)
+        add_log_sink(self.results)
+
+    def run(self):
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(len(self.ranges), mp_context=context) as executor:
+            futures = [
+                executor.submit(
+                    run_session,
+                    index,
+                    self.url,
+                    _min,
+                    _max,
+                    self.folder,
+                    self.first_display + index,
+                    self.screen,
+                    self.browser,
+                    self.write_to_file,
+                )
+                for index, (_min, _max) in enumerate(self.ranges)
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    loguru.logger.info(f"Session {future.result()} done.")
+                except Exception as err:
+                    loguru.logger.error(f"A session failed: {err!r}.")
+        if self.write_to_file:
+            self.merge_parameters()
+
+    def merge_parameters(self) -> None:
+        """
+        Writes the distinct parameters found by all the sessions in
+        `all_parameters.txt`, in the order they were found.
+        """
+        parameters: typing.Dict[str, None] = {}
+        for index in range(len(self.ranges)):
+            parameters_file = self.results / f"all_parameters_{index}.txt"
+            if parameters_file.exists():
+                parameters.update(dict.fromkeys(p for p in parameters_file.read_text().split() if p))
+        with open(str(self.results / "all_parameters.txt"), "w") as all_params_file:
+            for parameter in parameters:
+                all_params_file.write(f"{parameter}\n")
+        loguru.logger.info(f"{len(parameters)} parameters found by {len(self.ranges)} sessions.")
@@ -0,0 +1,241 @@
+"""
+Sharded HTTP crawl: worker processes, on one or more machines sharing the
+data folder, lease the (year, parameter) jobs from a common queue.
+
+The ledger and the cache are SQLite files in WAL mode, which can't be shared
+over a network filesystem: each machine keeps its own, by default in
+`~/.iksr/<data folder>-<hash>/`.
+
+Example::
+
+    # Fill the queue and run 4 workers on this machine
+    python -m src.shard ./data --url "<url>" --fill 1978 2018 --workers 4
+    # Join from another machine
+    python -m src.shard /mnt/data --url "<url>" --workers 4 --ledger /scratch/ledger.sqlite --cache /scratch/cache
+"""
+
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import hashlib
+import multiprocessing
+import os
+import pathlib
+import socket
+import threading
+import time
+import typing
+
+import loguru
+
+from .cache import ArchiveCache
+from .extractor import add_log_sink
+from .http import MUTEXES_DOWNLOAD
+from .http import MUTEXES_GENERATE
+from .http import NBR_MUTEX
+from .http import AsyncEngine
+from .http import Work
+from .http import read_jobs
+from .jobqueue import JobQueue
+from .ledger import DONE
+from .ledger import Ledger
+from .metrics import Metrics
+from .scheduler import AdaptiveLimit
+from .scheduler import Scheduler
+from .session import SessionPool
+
+QUEUE = "queue.sqlite"
+
+# Folder of the ledgers and caches of this machine
+LOCAL_FOLDER = pathlib.Path.home() / ".iksr"
+
+
+def local_folder(folder: pathlib.Path) -> pathlib.Path:
+    """
+    Returns the folder of this machine for the ledger and the cache of the
+    data :param:`folder`.
+    """
+    folder = folder.resolve()
+    return LOCAL_FOLDER / f"{folder.name}-{hashlib.sha1(str(folder).encode()).hexdigest()[:8]}"
+
+
+def fill_queue(folder: pathlib.Path, _min: int, _max: int) -> int:
+    """
+    Adds the jobs of the years from :param:`_min` to :param:`_max` to the
+    queue of this data :param:`folder`, and returns how many were added.
+    """
+    results = folder / "results"
+    jobs = read_jobs(results, range(_min, _max + 1))
+    with JobQueue(results / "http" / QUEUE) as queue:
+        added = queue.add((year, parameter) for year, parameters in jobs.items() for parameter in parameters)
+        loguru.logger.info(f"{added} jobs added to the queue: {queue.count()}.")
+    return added
+
+
+class ShardWorker:
+    """
+    Leases batches of :param:`batch_size` jobs from the queue of the data
+    :param:`folder` and downloads them in the shared `results/http/` folder,
+    until there is no job left. Leases are renewed while a batch runs, so
+    only the jobs of a dead worker expire.
+
+    By default, the ledger and the cache are those of
+    :class:`src.http.HTTPExtractor`. SQLite can't share them between machines,
+    so each machine should have its own :param:`ledger_path` and
+    :param:`cache`, see :func:`main`.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        folder: pathlib.Path,
+        worker: typing.Optional[str] = None,
+        batch_size: int = 16,
+        lease_duration: float = 300,
+        max_in_flight: int = 8,
+        max_generate: int = 4,
+        max_download: int = 4,
+        pool_size: int = 10,
+        poll_interval: float = 5,
+        scheduler: typing.Optional[Scheduler] = None,
+        cache: typing.Optional[ArchiveCache] = None,
+        ledger_path: typing.Optional[pathlib.Path] = None,
+    ):
+        self.url = url
+        self.results = folder / "results"
+        self.worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_generate = max_generate
+        self.max_download = max_download
+        self.poll_interval = poll_interval
+        add_log_sink(self.results)
+
+        self.queue = JobQueue(self.results / "http" / QUEUE, lease_duration)
+        self.ledger = Ledger(ledger_path or self.results / "http" / "ledger.sqlite")
+        self.cache = cache or ArchiveCache(folder / "cache")
+        self.scheduler = scheduler or Scheduler(limit=AdaptiveLimit(maximum=max_in_flight))
+        self.session_pool = SessionPool(pool_size=pool_size)
+        self.metrics = Metrics()
+        self.changed_files: typing.List[pathlib.Path] = []
+
+    def run(self) -> int:
+        """
+        Returns the number of jobs done by this worker.
+        """
+        done = 0
+        with self.session_pool, self.ledger, self.queue:
+            while True:
+                jobs = self.queue.lease(self.worker, self.batch_size)
+                if not jobs:
+                    if not self.queue.remaining():
+                        break
+                    # The jobs leased by the other workers expire if they die.
+                    time.sleep(self.poll_interval)
+                    continue
+                done += self.run_batch(jobs)
+            loguru.logger.info(f"[{self.worker}]: {done} jobs done, queue: {self.queue.count()}.")
+        self.write()
+        return done
+
+    def run_batch(self, jobs: typing.List[typing.Tuple[str, str]]) -> int:
+        parameters: typing.Dict[str, typing.Dict[str, int]] = {}
+        for year, parameter in jobs:
+            parameters.setdefault(year, {})[parameter] = 0
+        works = [
+            Work(
+                self.results,
+                self.url,
+                year,
+                year_parameters,
+                MUTEXES_GENERATE[i % NBR_MUTEX],
+                MUTEXES_DOWNLOAD[i % NBR_MUTEX],
+                self.session_pool,
+                self.ledger,
+                self.scheduler,
+                self.cache,
+                self.metrics,
+            )
+            for i, (year, year_parameters) in enumerate(parameters.items())
+        ]
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._renew, args=(jobs, stop), daemon=True)
+        heartbeat.start()
+        try:
+            AsyncEngine(works, self.scheduler, self.max_in_flight, self.max_generate, self.max_download).run()
+        except BaseException:
+            for year, parameter in jobs:
+                if self.ledger.status(year, parameter) != DONE:
+                    self.queue.release(self.worker, year, parameter)
+            raise
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        done = 0
+        for year, parameter in jobs:
+            if self.ledger.status(year, parameter) == DONE:
+                self.queue.done(self.worker, year, parameter)
+                done += 1
+            else:
+                self.queue.failed(self.worker, year, parameter)
+        for work in works:
+            self.changed_files.extend(work.changed_files)
+        return done
+
+    def _renew(self, jobs: typing.List[typing.Tuple[str, str]], stop: threading.Event) -> None:
+        while not stop.wait(self.queue.lease_duration / 3):
+            self.queue.renew(self.worker, jobs)
+
+    def write(self) -> None:
+        """
+        Writes the metrics and the changed files of this worker in
+        `results/http/`, suffixed by its name.
+        """
+        http_folder = self.results / "http"
+        self.metrics.write(http_folder / f"metrics-{self.worker}.json", http_folder / f"metrics-{self.worker}.csv")
+        with open(str(http_folder / f"changed_files-{self.worker}.txt"), "w") as changed_files_file:
+            for csv_file in self.changed_files:
+                changed_files_file.write(f"{csv_file}\n")
+
+
+def run_worker(url: str, folder: pathlib.Path, cache_folder: typing.Optional[pathlib.Path] = None, **kwargs) -> int:
+    cache = ArchiveCache(cache_folder) if cache_folder is not None else None
+    return ShardWorker(url, folder, cache=cache, **kwargs).run()
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folder", type=pathlib.Path, help="Data folder, shared by all the workers.")
+    parser.add_argument("--url", required=True, help="URL template of the generate step, see src.__main__.")
+    parser.add_argument("--fill", type=int, nargs=2, metavar=("MIN", "MAX"), help="Add the jobs of these years.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes on this machine.")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--lease-duration", type=float, default=300.0)
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--ledger", type=pathlib.Path, help="Ledger of this machine, on a local filesystem.")
+    parser.add_argument("--cache", type=pathlib.Path, help="Cache folder of this machine, on a local filesystem.")
+    args = parser.parse_args(argv)
+
+    if args.fill:
+        fill_queue(args.folder, *args.fill)
+    local = local_folder(args.folder)
+    kwargs = dict(
+        batch_size=args.batch_size,
+        lease_duration=args.lease_duration,
+        max_in_flight=args.max_in_flight,
+        ledger_path=args.ledger or local / "ledger.sqlite",
+        cache_folder=args.cache or local / "cache",
+    )
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(args.workers, mp_context=context) as executor:
+        futures = [executor.submit(run_worker, args.url, args.folder, **kwargs) for _ in range(args.workers)]
+        done = sum(future.result() for future in futures)
+    loguru.logger.info(f"{done} jobs done by {args.workers} workers.")
+    return done
+
+
+if __name__ == "__main__":
+    main()
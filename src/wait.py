@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import collections
+import dataclasses
+import pathlib
+import threading
+import time
+import typing
+
+import loguru
+import numpy as np
+import pyscreeze
+
+from .locator import LOCATOR
+
+T = typing.TypeVar("T")
+
+
+@dataclasses.dataclass
+class WaitStats:
+    count: int = 0
+    timeouts: int = 0
+    total: float = 0.0
+
+
+# Time spent in each kind of wait
+WAITS: typing.DefaultDict[str, WaitStats] = collections.defaultdict(WaitStats)
+_MUTEX_WAITS = threading.Lock()
+
+
+def wait_for(
+    condition: typing.Callable[[], typing.Optional[T]], timeout: float, interval: float = 0.05, name: str = ""
+) -> typing.Optional[T]:
+    """
+    Polls :param:`condition` every :param:`interval` seconds until it returns
+    a truthy value, which is returned, or :param:`timeout` seconds are
+    elapsed, in which case `None` is returned. The time taken is logged and
+    summed in :data:`WAITS`.
+    """
+    start = time.monotonic()
+    while True:
+        value = condition()
+        elapsed = time.monotonic() - start
+        if value or elapsed >= timeout:
+            break
+        time.sleep(min(interval, timeout - elapsed))
+    with _MUTEX_WAITS:
+        stats = WAITS[name]
+        stats.count += 1
+        stats.total += elapsed
+        if not value:
+            stats.timeouts += 1
+    loguru.logger.debug(f"{name}: {'done' if value else 'timeout'} after {elapsed:.3f}s.")
+    return value or None
+
+
+def log_waits() -> None:
+    with _MUTEX_WAITS:
+        for name, stats in sorted(WAITS.items(), key=lambda item: item[1].total, reverse=True):
+            loguru.logger.info(
+                f"{name}: {stats.count} waits, {stats.timeouts} timeouts, {stats.total:.1f}s "
+                f"({stats.total / stats.count:.3f}s on average)."
+            )
+
+
+def appears(
+    *imgs: typing.Union[str, pathlib.Path], **kwargs
+) -> typing.Callable[[], typing.Optional[typing.Tuple[typing.Union[str, pathlib.Path], pyscreeze.Box]]]:
+    """
+    Condition true when one of :param:`imgs` is on the screen, returning it
+    with its position.
+    """
+
+    def condition():
+        LOCATOR.invalidate()
+        for img in imgs:
+            box = LOCATOR.locate(img, **kwargs)
+            if box is not None:
+                return img, box
+
+    return condition
+
+
+def disappears(img: typing.Union[str, pathlib.Path], **kwargs) -> typing.Callable[[], bool]:
+    def condition():
+        LOCATOR.invalidate()
+        return LOCATOR.locate(img, **kwargs) is None
+
+    return condition
+
+
+def changes() -> typing.Callable[[], bool]:
+    """
+    Condition true when the screen differs from a screenshot taken now. A
+    new one is taken, as the shared one may be older than the last click.
+    """
+    LOCATOR.invalidate()
+    before = LOCATOR.screenshot()
+
+    def condition():
+        LOCATOR.invalidate()
+        return not np.array_equal(before, LOCATOR.screenshot())
+
+    return condition
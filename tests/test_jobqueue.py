@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import multiprocessing
+import pathlib
+import sqlite3
+import traceback
+
+from src.jobqueue import DONE
+from src.jobqueue import JobQueue
+from src.ledger import Ledger
+
+WORKERS = 4
+CONTEXT = multiprocessing.get_context("spawn")
+
+
+def _open_ledger(path: pathlib.Path, name: str, barrier, results) -> None:
+    try:
+        barrier.wait()
+        with Ledger(path) as ledger:
+            ledger.pending("2000", [name])
+            ledger.done("2000", name, b"content", etag=name)
+        results.put((name, None))
+    except Exception:
+        results.put((name, traceback.format_exc()))
+
+
+def _lease_all(path: pathlib.Path, name: str, barrier, results) -> None:
+    try:
+        barrier.wait()
+        leased = []
+        with JobQueue(path) as queue:
+            while True:
+                jobs = queue.lease(name, 5)
+                if not jobs:
+                    break
+                for year, parameter in jobs:
+                    queue.done(name, year, parameter)
+                leased.extend(jobs)
+        results.put((name, leased))
+    except Exception:
+        results.put((name, traceback.format_exc()))
+
+
+def _run(target, path: pathlib.Path) -> dict:
+    barrier = CONTEXT.Barrier(WORKERS)
+    results = CONTEXT.Queue()
+    processes = [CONTEXT.Process(target=target, args=(path, f"w{i}", barrier, results)) for i in range(WORKERS)]
+    for process in processes:
+        process.start()
+    outputs = dict(results.get(timeout=60) for _ in processes)
+    for process in processes:
+        process.join()
+    return outputs
+
+
+def test_ledger_migrated_by_concurrent_workers(tmp_path: pathlib.Path):
+    path = tmp_path / "ledger.sqlite"
+    # First version of the ledger, without the validators columns.
+    cnxn = sqlite3.connect(str(path))
+    cnxn.execute(
+        "create table jobs (year text not null, parameter text not null, status text not null, "
+        "attempts integer not null default 0, size integer, checksum text, updated_at text, "
+        "primary key (year, parameter))"
+    )
+    cnxn.commit()
+    cnxn.close()
+
+    outputs = _run(_open_ledger, path)
+    assert {name: error for name, error in outputs.items() if error} == {}
+    with Ledger(path) as ledger:
+        assert ledger.count() == {"done": WORKERS}
+        assert ledger.validators("2000", "w0")[1] == "w0"
+
+
+def test_jobs_leased_once(tmp_path: pathlib.Path):
+    path = tmp_path / "queue.sqlite"
+    jobs = [(str(year), f"P{parameter}") for year in range(2000, 2010) for parameter in range(20)]
+    with JobQueue(path) as queue:
+        assert queue.add(jobs) == len(jobs)
+
+    outputs = _run(_lease_all, path)
+    assert all(isinstance(leased, list) for leased in outputs.values()), outputs
+    leased = [tuple(job) for jobs_of_worker in outputs.values() for job in jobs_of_worker]
+    assert sorted(leased) == sorted(jobs)
+    with JobQueue(path) as queue:
+        assert queue.count() == {DONE: len(jobs)}
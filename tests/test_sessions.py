@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+import pathlib
+
+from src.extractor import remove_log_sink
+from src.sessions import GUISessions
+from src.sessions import VirtualDisplay
+from src.sessions import split_years
+
+
+def test_virtual_display():
+    display = VirtualDisplay(95, "800x600x24")
+    assert display.name == ":95"
+    assert display.screen == "800x600x24"
+
+
+def test_sessions_options(tmp_path: pathlib.Path):
+    sessions = GUISessions("<url>", 2000, 2004, tmp_path, sessions=2, write_to_file=False)
+    try:
+        assert sessions.write_to_file is False
+        assert sessions.ranges == [(2000, 2002), (2003, 2004)]
+    finally:
+        remove_log_sink(sessions.results)
+
+
+def test_split_years():
+    assert split_years(2000, 2001, 4) == [(2000, 2000), (2001, 2001)]